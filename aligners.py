@@ -1,23 +1,31 @@
 import os
+import json
+import uuid
 import logging
-import whisperx
 from config import Config
+from models import ModelManager
+from metrics import record_cache
+from hashing import hash_file
 from subtitles_engine import AdvancedSRTtoASSConverter
-import langid
-from aeneas.executetask import ExecuteTask
-from aeneas.task import Task
+
+# whisperx (torch), aeneas and langid are imported where they are first used,
+# so importing this module stays cheap for processes that never align
 
 
 class LyricsAligner:
     def __init__(self, config):
         self.config = config
 
-    def align_lyrics(self, vocal_audio_full_path):
+    def align_lyrics(self, vocal_audio_full_path, task_config: Config):
+        import langid
+        from aeneas.executetask import ExecuteTask
+        from aeneas.task import Task
+
         input_text_path = os.path.join(
-            self.config.input_cache, self.config.text_file_name
+            self.config.input_cache, task_config.text_file_name
         )
         sync_file_path = os.path.join(
-            self.config.output_cache, f"{self.config.audio_file_name}.srt"
+            self.config.output_cache, f"{task_config.get_output_name()}.srt"
         )
 
         logging.info("Detecting lyrics language...")
@@ -26,6 +34,8 @@ class LyricsAligner:
         language, confidence = langid.classify(text)
         logging.info(f"Detected language {language} with confidence: {confidence}")
 
+        # Per task copy, the shared config must not carry one task's language
+        aligner_config_string = self.config.aligner_config_string
         if language != "en":
             new_lang = "rus" if language == "ru" else ""
             if not new_lang:
@@ -34,13 +44,11 @@ class LyricsAligner:
                     "If you wish to use it, contact us in discord."
                 )
             logging.info(f"Changing aligner config to {new_lang}")
-            self.config.aligner_config_string = (
-                self.config.aligner_config_string.replace("eng", new_lang)
-            )
-            logging.info(f"Updated aligner config {self.config.aligner_config_string}")
+            aligner_config_string = aligner_config_string.replace("eng", new_lang)
+            logging.info(f"Updated aligner config {aligner_config_string}")
 
         logging.info("Aligning audio with lyrics...")
-        task = Task(config_string=self.config.aligner_config_string)
+        task = Task(config_string=aligner_config_string)
         task.audio_file_path_absolute = vocal_audio_full_path
         task.text_file_path_absolute = input_text_path
         task.sync_map_file_path_absolute = sync_file_path
@@ -54,14 +62,47 @@ class LyricsAligner:
 
         return sync_file_path
 
+    def align_words(self, vocal_audio_full_path, task_config: Config):
+        # Aeneas aligns whole lines straight into an SRT sync map
+        return self.align_lyrics(vocal_audio_full_path, task_config)
+
+    def create_subtitles(self, sync_file_path, task_config: Config, resolution=None):
+        # Plain SRT is scaled by libass, so every resolution shares the same file
+        return sync_file_path
+
 
 class LyricsAlignerWithWhisper:
-    def __init__(self, config):
+    # Memory accounted for a model before its first load measures it
+    WHISPER_SIZE_ESTIMATE = 3 * 1024**3
+    ALIGN_MODEL_SIZE_ESTIMATE = 1024**3
+    WHISPER_MODEL = "large-v2"
+
+    def __init__(self, config, model_manager=None):
         self.config = config
         self.device = "cuda" if config.gpu_on else "cpu"
-        self.model = whisperx.load_model("large-v2", device=self.device)
+        self.model_manager = model_manager or ModelManager()
+        # The whisperx pipeline swaps its tokenizer per call, so calls take turns
+        self.model = self.model_manager.register(
+            "whisper",
+            self.load_whisper_model,
+            thread_safe=False,
+            size_estimate=self.WHISPER_SIZE_ESTIMATE,
+        )
+        self.model.get()
         self.music_subtitles_generator = AdvancedSRTtoASSConverter(config)
 
+    def load_whisper_model(self):
+        import whisperx
+
+        return whisperx.load_model(self.WHISPER_MODEL, device=self.device)
+
+    def load_align_model(self, language_code):
+        import whisperx
+
+        return whisperx.load_align_model(
+            language_code=language_code, device=self.device
+        )
+
     def format_time(self, time_in_seconds):
         # Convert seconds to hours, minutes, seconds, and milliseconds
         hours = int(time_in_seconds // 3600)
@@ -89,36 +130,91 @@ class LyricsAlignerWithWhisper:
                 srt_file.write(f"{start_time_str} --> {end_time_str}\n")
                 srt_file.write(f"{text}\n\n")
 
-    def align_lyrics(self, vocal_audio_full_path, task_config: Config):
-        sync_file_path = os.path.join(
-            self.config.output_cache, f"{task_config.audio_file_name}.srt"
-        )
+    def transcribe_words(self, vocal_audio_full_path):
+        import whisperx
 
         logging.info("Transcribing audio with WhisperX...")
-        result = self.model.transcribe(vocal_audio_full_path, chunk_size=30)
+        with self.model.use() as model:
+            result = model.transcribe(vocal_audio_full_path, chunk_size=30)
         # 2. Align whisper output
-        model_a, metadata = whisperx.load_align_model(
-            language_code=result["language"], device=self.device
+        with self.get_align_model(result["language"]).use() as (model_a, metadata):
+            result = whisperx.align(
+                result["segments"],
+                model_a,
+                metadata,
+                vocal_audio_full_path,
+                self.device,
+                return_char_alignments=False,
+            )
+        return result["word_segments"]
+
+    def get_align_model(self, language_code):
+        return self.model_manager.register(
+            f"whisperx_align_{language_code}",
+            lambda: self.load_align_model(language_code),
+            size_estimate=self.ALIGN_MODEL_SIZE_ESTIMATE,
         )
-        result = whisperx.align(
-            result["segments"],
-            model_a,
-            metadata,
-            vocal_audio_full_path,
-            self.device,
-            return_char_alignments=False,
+
+    def get_words_cache_path(self, task_config: Config):
+        """Word timings are cached by the audio's content and the Whisper model."""
+        source_hash = hash_file(
+            os.path.join(self.config.input_cache, task_config.audio_file_name)
+        )
+        return os.path.join(
+            self.config.output_cache,
+            "words",
+            f"{source_hash}_{self.WHISPER_MODEL}.json",
         )
-        raw_subs = result["word_segments"]
 
-        if self.config.production_type == "music":
-            self.music_subtitles_generator.convert(
-                raw_subs, sync_file_path, task_config
-            )
+    def load_cached_words(self, words_cache_path):
+        """Load word timings saved by a previous run on the same audio."""
+        if not os.path.exists(words_cache_path):
+            return None
+        with open(words_cache_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def align_words(self, vocal_audio_full_path, task_config: Config):
+        """Transcribe word timings once and return the path of their JSON cache."""
+        words_cache_path = self.get_words_cache_path(task_config)
+        cached_words = self.load_cached_words(words_cache_path)
+        record_cache("words", cached_words is not None)
+        if cached_words is None:
+            raw_subs = self.transcribe_words(vocal_audio_full_path)
+            os.makedirs(os.path.dirname(words_cache_path), exist_ok=True)
+            partial_path = f"{words_cache_path}.{uuid.uuid4().hex}.partial"
+            with open(partial_path, "w", encoding="utf-8") as f:
+                json.dump(raw_subs, f)
+            os.replace(partial_path, words_cache_path)
         else:
+            logging.info(f"Reusing cached alignment {words_cache_path}")
+        return words_cache_path
+
+    def create_subtitles(self, words_path, task_config: Config, resolution=None):
+        """Lay word timings out as subtitles, per video resolution for music."""
+        with open(words_path, "r", encoding="utf-8") as f:
+            raw_subs = json.load(f)
+        sync_file_path = os.path.join(
+            self.config.output_cache, f"{task_config.get_output_name()}.srt"
+        )
+        if task_config.production_type != "music":
             self.save_lyrics(raw_subs, sync_file_path)
+            return sync_file_path
+        if resolution is not None:
+            width, height = map(int, resolution)
+            sync_file_path = os.path.join(
+                self.config.output_cache,
+                f"{task_config.get_output_name()}_{width}x{height}.ass",
+            )
+        self.music_subtitles_generator.convert(
+            raw_subs, sync_file_path, task_config, resolution
+        )
         print(f"Transcription saved to {sync_file_path}")
         return sync_file_path
 
+    def align_lyrics(self, vocal_audio_full_path, task_config: Config):
+        words_path = self.align_words(vocal_audio_full_path, task_config)
+        return self.create_subtitles(words_path, task_config)
+
 
 # Example usage
 if __name__ == "__main__":
@@ -137,7 +233,7 @@ if __name__ == "__main__":
         "/app/synclyr/data/inputs_cache/audio_cache/"
         "09f7803f-baad-485e-afe9-186ca2024256.mp4_(Vocals)_Kim_Vocal_2.wav"
     )
-    sync_file_path = aligner.align_lyrics(vocal_audio_full_path)
+    sync_file_path = aligner.align_lyrics(vocal_audio_full_path, config)
     if sync_file_path:
         print(f"Sync file created at: {sync_file_path}")
     else:
@@ -1,54 +1,127 @@
 import os
-import ffmpeg
+import uuid
 from config import Config
-from audio_separator.separator import Separator
 import logging
+from models import ModelManager
+from metrics import record_cache
+from hashing import hash_file
 
 
 class AudioProcessor:
-    def __init__(self, config):
+    # Memory accounted for the separator before its first load measures it
+    SEPARATOR_SIZE_ESTIMATE = 512 * 1024**2
+
+    def __init__(self, config, model_manager=None):
         self.config = config
         self.audio_cache_path = os.path.join(self.config.input_cache, "audio_cache")
+        self.model_manager = model_manager or ModelManager()
+        # The separator keeps per-call state, so tasks take turns using it
+        self.vocal_separator = self.model_manager.register(
+            "vocal_separator",
+            self.load_vocal_separator,
+            thread_safe=False,
+            size_estimate=self.SEPARATOR_SIZE_ESTIMATE,
+        )
+        self.vocal_separator.get()
+
+    def load_vocal_separator(self):
+        # Imported on first load, it pulls in onnxruntime
+        from audio_separator.separator import Separator
+
         vocal_separator = Separator(
             output_dir=self.audio_cache_path,
             model_file_dir=os.path.dirname(self.config.vocal_separator_model),
         )
         vocal_separator.load_model(os.path.basename(self.config.vocal_separator_model))
-        self.vocal_separator = vocal_separator
+        return vocal_separator
 
     def convert_audio(self, input_mp3_path, output_wav_path):
+        import ffmpeg
+
         if os.path.exists(output_wav_path):
             return output_wav_path
+        # Convert into a private file so concurrent tasks never see a partial one
+        root, extension = os.path.splitext(output_wav_path)
+        partial_path = f"{root}.{uuid.uuid4().hex}.partial{extension}"
         try:
-            ffmpeg.input(input_mp3_path).output(output_wav_path).run()
+            ffmpeg.input(input_mp3_path).output(partial_path).run()
+            os.replace(partial_path, output_wav_path)
             logging.info(f"Conversion successful: {output_wav_path}")
         except ffmpeg.Error as e:
             logging.error(
                 f"Error occurred during conversion: {e.stderr.decode('utf8')}"
             )
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
         return output_wav_path
 
     def perform_vocal_separation(self, task_config: Config):
-        input_audio_path = os.path.join(
-            self.config.input_cache, task_config.audio_file_name
+        input_audio_path = self.decode_audio(task_config)
+        instrumental_audio_full_path, vocal_audio_full_path = self.separate(
+            input_audio_path, self.get_source_hash(task_config)
         )
-        audio_cache_path = self.audio_cache_path
+        return input_audio_path, vocal_audio_full_path, instrumental_audio_full_path
 
-        os.makedirs(audio_cache_path, exist_ok=True)
+    def decode_audio(self, task_config: Config):
+        """Return the upload as a wav file, converting it when needed.
 
+        Conversions are named after the upload's content, so a new song
+        saved under an old name is never served the old conversion.
+        """
+        input_audio_path = os.path.join(
+            self.config.input_cache, task_config.audio_file_name
+        )
         if not input_audio_path.endswith(".wav"):
+            os.makedirs(self.audio_cache_path, exist_ok=True)
             input_audio_path = self.convert_audio(
-                input_audio_path, input_audio_path + ".wav"
+                input_audio_path,
+                os.path.join(
+                    self.audio_cache_path, f"{self.get_source_hash(task_config)}.wav"
+                ),
             )
+        return input_audio_path
 
-        outputs = self.vocal_separator.separate(input_audio_path)
-
-        instrumental_audio_file = outputs[0]
-        instrumental_audio_full_path = os.path.join(
-            audio_cache_path, instrumental_audio_file
+    def get_source_hash(self, task_config: Config):
+        """sha256 of the uploaded audio, memoized since the upload hashed it."""
+        return hash_file(
+            os.path.join(self.config.input_cache, task_config.audio_file_name)
         )
 
-        vocal_audio_file = outputs[-1]
-        vocal_audio_full_path = os.path.join(audio_cache_path, vocal_audio_file)
+    def separate(self, input_audio_path, source_hash=None):
+        """Return (instrumental, vocals) stems of a wav file.
 
-        return input_audio_path, vocal_audio_full_path, instrumental_audio_full_path
+        Stems are cached by source_hash, the content hash of the audio the
+        wav was decoded from, so the same song is separated once whatever
+        its file is called. It defaults to the hash of the wav itself.
+        """
+        audio_cache_path = self.audio_cache_path
+        os.makedirs(audio_cache_path, exist_ok=True)
+        stem_paths = self.get_stem_paths(source_hash or hash_file(input_audio_path))
+
+        with self.vocal_separator.use() as vocal_separator:
+            # Checked under the lock, a concurrent task may have just separated it
+            cached = all(os.path.exists(path) for path in stem_paths)
+            record_cache("separation", cached)
+            if cached:
+                logging.info(f"Reusing cached separation for {input_audio_path}")
+                return stem_paths
+
+            outputs = vocal_separator.separate(input_audio_path)
+
+            # The separator names its outputs after the input file. Renamed
+            # under the lock, a concurrent task never sees or moves half a stem
+            for output_file, stem_path in zip((outputs[0], outputs[-1]), stem_paths):
+                os.replace(os.path.join(audio_cache_path, output_file), stem_path)
+        return stem_paths
+
+    def get_stem_paths(self, source_hash):
+        """Cached (instrumental, vocals) paths of a source and separator model."""
+        model_name = os.path.splitext(
+            os.path.basename(self.config.vocal_separator_model)
+        )[0]
+        return [
+            os.path.join(
+                self.audio_cache_path, f"{source_hash}_{model_name}_{stem}.wav"
+            )
+            for stem in ("instrumental", "vocals")
+        ]
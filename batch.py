@@ -0,0 +1,215 @@
+"""Run a manifest of songs through the pipeline in a pool of worker processes.
+
+With --cpu the workers are forked after the models are loaded once and
+share them; on the GPU every worker loads its own.
+
+The manifest is CSV with a header or JSONL, one task per row. Columns are
+audio, lyrics and background, paths relative to --inputs_cache, plus any
+task option of Config.USER_DATA_FIELDS (production_type, video_resolution,
+preview, ...). In CSV, resolutions are written as 1920x1080 and lists are
+separated by ";".
+
+Usage: python batch.py catalog.csv --results results.jsonl --workers 2
+"""
+
+import argparse
+import csv
+import json
+import logging
+import os
+from concurrent.futures import as_completed
+from config import Config
+from lyri_core import LyricsVideoGenerator
+from pipeline import StageManifest
+from workers import WorkerPool
+
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
+
+FILE_COLUMNS = {
+    "audio": "audio_file_name",
+    "lyrics": "text_file_name",
+    "background": "background_file_name",
+}
+RESOLUTION_FIELDS = ("video_resolution",)
+RESOLUTION_LIST_FIELDS = ("extra_resolutions",)
+BOOLEAN_FIELDS = ("preview", "hls", "profile")
+FLOAT_FIELDS = ("preview_scale",)
+FLOAT_LIST_FIELDS = ("preview_range", "hls_ladder")
+
+
+def read_manifest(manifest_path):
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        if manifest_path.endswith(".jsonl"):
+            return [json.loads(line) for line in f if line.strip()]
+        return list(csv.DictReader(f))
+
+
+def parse_resolution(value):
+    return [int(size) for size in value.lower().split("x")]
+
+
+def parse_csv_value(field, value):
+    """Turn a CSV string into the type Config expects for the field."""
+    if field in RESOLUTION_FIELDS:
+        return parse_resolution(value)
+    if field in RESOLUTION_LIST_FIELDS:
+        return [parse_resolution(item) for item in value.split(";") if item]
+    if field in BOOLEAN_FIELDS:
+        return value.strip().lower() in ("1", "true", "yes")
+    if field in FLOAT_FIELDS:
+        return float(value)
+    if field in FLOAT_LIST_FIELDS:
+        return [float(item) for item in value.split(";") if item]
+    return value
+
+
+def to_user_data(row, input_cache, from_csv):
+    user_data = {}
+    for column, value in row.items():
+        if value in (None, ""):
+            continue
+        field = FILE_COLUMNS.get(column, column)
+        if field in FILE_COLUMNS.values():
+            # Output names derive from these, so they must stay relative
+            full_path = os.path.abspath(os.path.join(input_cache, value))
+            relative_path = os.path.relpath(full_path, input_cache)
+            if relative_path == os.pardir or relative_path.startswith(
+                os.pardir + os.sep
+            ):
+                raise ValueError(f"{value} is outside the inputs cache")
+            value = relative_path
+        elif field not in Config.USER_DATA_FIELDS:
+            raise ValueError(f"Unknown manifest column {column}")
+        elif from_csv:
+            value = parse_csv_value(field, value)
+        user_data[field] = value
+    if "audio_file_name" not in user_data:
+        raise ValueError("Row has no audio")
+    return user_data
+
+
+def read_timings(timings_path):
+    if not timings_path or not os.path.exists(timings_path):
+        return None
+    with open(timings_path, "r") as f:
+        return json.load(f)
+
+
+def job_record(index, task_id, future, output_cache):
+    """Result line of a finished job of the worker pool."""
+    try:
+        result = future.result()
+        status = "completed" if result else "failed"
+        error = None
+    except Exception as e:
+        result = None
+        status = "error"
+        error = str(e)
+    timings = read_timings(os.path.join(output_cache, "timings", f"{task_id}.json"))
+    return {
+        "row": index,
+        "task_id": task_id,
+        "status": status,
+        "error": error,
+        "elapsed": timings["wall"] if timings else None,
+        "result": result,
+        "timings": timings,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch processing of a manifest")
+    parser.add_argument("manifest", help="CSV or JSONL manifest of tasks", type=str)
+    parser.add_argument("--results", default="results.jsonl", type=str)
+    parser.add_argument("--workers", default=1, type=int)
+    parser.add_argument("--inputs_cache", default=None, type=str)
+    parser.add_argument("--outputs_cache", default="./aligner_cache/", type=str)
+    parser.add_argument("--production_type", default="music", type=str)
+    parser.add_argument(
+        "--cpu",
+        action="store_true",
+        help="Run the models on the CPU, shared by workers forked after loading",
+    )
+    parser.add_argument(
+        "--vocal_separator_model",
+        default="./checkpoints/vocal_separator/Kim_Vocal_2.onnx",
+        type=str,
+    )
+    args = parser.parse_args()
+    # Manifest paths are relative to its own folder unless told otherwise
+    input_cache = os.path.abspath(
+        args.inputs_cache or os.path.dirname(os.path.abspath(args.manifest))
+    )
+    output_cache = os.path.abspath(args.outputs_cache)
+    os.makedirs(output_cache, exist_ok=True)
+
+    rows = read_manifest(args.manifest)
+    from_csv = not args.manifest.endswith(".jsonl")
+    counts = {}
+    with open(args.results, "a", encoding="utf-8") as results_file:
+
+        def write_result(record):
+            counts[record["status"]] = counts.get(record["status"], 0) + 1
+            results_file.write(json.dumps(record) + "\n")
+            results_file.flush()
+
+        jobs = []
+        for index, row in enumerate(rows):
+            try:
+                user_data = to_user_data(row, input_cache, from_csv)
+            except ValueError as e:
+                write_result({"row": index, "status": "invalid", "error": str(e)})
+                continue
+            user_data.setdefault("production_type", args.production_type)
+            task_config = Config(input_cache, output_cache)
+            task_config.from_user_data(user_data)
+            task_id = LyricsVideoGenerator.get_task_id(task_config)
+            manifest = StageManifest(
+                os.path.join(output_cache, "manifests", f"{task_id}.json")
+            )
+            # Outputs are named after the audio, so they mirror its folders
+            os.makedirs(
+                os.path.dirname(
+                    os.path.join(output_cache, user_data["audio_file_name"])
+                ),
+                exist_ok=True,
+            )
+            if manifest.is_complete():
+                timings_path = os.path.join(output_cache, "timings", f"{task_id}.json")
+                write_result(
+                    {
+                        "row": index,
+                        "task_id": task_id,
+                        "status": "skipped",
+                        "result": manifest.outputs(),
+                        "timings": read_timings(timings_path),
+                    }
+                )
+                continue
+            jobs.append((index, task_id, user_data))
+
+        logging.info(
+            f"{len(jobs)} tasks to run, {len(rows) - len(jobs)} skipped or invalid"
+        )
+        if jobs:
+            config = Config(input_cache, output_cache, args.vocal_separator_model)
+            config.gpu_on = not args.cpu
+            pool = WorkerPool(config, args.workers)
+            futures = {
+                pool.submit(user_data): (index, task_id)
+                for index, task_id, user_data in jobs
+            }
+            for future in as_completed(futures):
+                index, task_id = futures[future]
+                record = job_record(index, task_id, future, output_cache)
+                logging.info(f"Row {index} {record['status']}")
+                write_result(record)
+            pool.shutdown()
+
+    logging.info(f"Batch finished: {counts}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Import time of the pipeline modules, from python -X importtime.
+
+Prints the cumulative import time of every module and the slowest imports
+it pulls in. Exits with 1 if a module imports one of the heavy packages at
+import time, or takes longer than --max_ms, so it can guard CI.
+
+Usage: python benchmarks/import_time.py --modules lyri_core aligners --top 10
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+REPO_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Must only be imported when a model is loaded or a file is processed
+HEAVY_MODULES = (
+    "torch",
+    "whisperx",
+    "aeneas",
+    "audio_separator",
+    "onnxruntime",
+    "langid",
+    "ffmpeg",
+    "PIL",
+)
+
+
+def measure(module):
+    """Return (cumulative us, [(self us, name)], imported heavy modules)."""
+    process = subprocess.run(
+        [
+            sys.executable,
+            "-X",
+            "importtime",
+            "-c",
+            f"import sys, json, {module}; print(json.dumps(sorted(sys.modules)))",
+        ],
+        cwd=REPO_PATH,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    total = 0
+    imports = []
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        imports.append((int(self_us), name.strip()))
+        if name.strip() == module:
+            total = int(cumulative_us)
+    loaded = json.loads(process.stdout.splitlines()[-1])
+    heavy = [name for name in HEAVY_MODULES if name in loaded]
+    return total, imports, heavy
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import time benchmark")
+    parser.add_argument(
+        "--modules",
+        nargs="+",
+        default=["lyri_core", "aligners", "audio_processor", "pipeline"],
+    )
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--max_ms", type=float, default=None)
+    args = parser.parse_args()
+
+    failed = False
+    for module in args.modules:
+        # The fastest run is the least disturbed by the rest of the machine
+        runs = [measure(module) for _ in range(args.repeat)]
+        total, imports, heavy = min(runs, key=lambda run: run[0])
+        print(f"{module}: {total / 1000:.1f} ms")
+        for self_us, name in sorted(imports, reverse=True)[: args.top]:
+            print(f"  {self_us / 1000:7.1f} ms  {name}")
+        if heavy:
+            print(f"  imports heavy modules: {', '.join(heavy)}")
+            failed = True
+        if args.max_ms is not None and total / 1000 > args.max_ms:
+            print(f"  slower than {args.max_ms} ms")
+            failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
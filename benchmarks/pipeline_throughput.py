@@ -0,0 +1,125 @@
+"""Jobs/hour of a fixture job queue, run one by one and on per-stage pools.
+
+Every fixture is a pair of an audio file and a lyrics file with the same
+name, e.g. song.mp3 and song.txt. Stems and word timings are cached by
+the audio's content, so every job needs a fixture of its own: --jobs may
+not exceed the number of fixtures.
+
+Usage: python benchmarks/pipeline_throughput.py --fixtures ./fixtures --jobs 8
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config
+from lyri_core import LyricsVideoGenerator
+from pipeline import StageScheduler
+
+
+def find_fixtures(fixtures_path):
+    fixtures = []
+    for file_name in sorted(os.listdir(fixtures_path)):
+        base_name, extension = os.path.splitext(file_name)
+        text_path = os.path.join(fixtures_path, f"{base_name}.txt")
+        if extension != ".txt" and os.path.exists(text_path):
+            fixtures.append((os.path.join(fixtures_path, file_name), text_path))
+    return fixtures
+
+
+def prepare_jobs(fixtures, jobs, input_cache, production_type):
+    task_configs = []
+    for i in range(jobs):
+        audio_path, text_path = fixtures[i]
+        audio_file_name = f"job{i}_{os.path.basename(audio_path)}"
+        text_file_name = f"job{i}_{os.path.basename(text_path)}"
+        shutil.copy(audio_path, os.path.join(input_cache, audio_file_name))
+        shutil.copy(text_path, os.path.join(input_cache, text_file_name))
+        task_config = Config(None, None)
+        task_config.from_user_data(
+            {
+                "task_id": f"job{i}",
+                "audio_file_name": audio_file_name,
+                "text_file_name": text_file_name,
+                "production_type": production_type,
+            }
+        )
+        task_configs.append(task_config)
+    return task_configs
+
+
+def run_sequential(generator, task_configs):
+    for task_config in task_configs:
+        generator.generate(task_config)
+
+
+def run_pipelined(generator, task_configs, workers):
+    scheduler = StageScheduler(workers)
+    futures = [generator.submit(task_config, scheduler) for task_config in task_configs]
+    for future in futures:
+        future.result()
+    scheduler.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pipeline throughput benchmark")
+    parser.add_argument("--fixtures", type=str, required=True)
+    parser.add_argument("--jobs", type=int, default=8)
+    parser.add_argument("--production_type", type=str, default="music")
+    parser.add_argument("--separate_workers", type=int, default=1)
+    parser.add_argument("--align_workers", type=int, default=1)
+    parser.add_argument("--render_workers", type=int, default=2)
+    parser.add_argument(
+        "--vocal_separator_model",
+        type=str,
+        default="./checkpoints/vocal_separator/Kim_Vocal_2.onnx",
+    )
+    args = parser.parse_args()
+
+    fixtures = find_fixtures(args.fixtures)
+    if not fixtures:
+        sys.exit(f"No audio/lyrics pairs found in {args.fixtures}")
+    if args.jobs > len(fixtures):
+        # A repeated song would hit the content keyed caches and skip its work
+        sys.exit(f"--jobs {args.jobs} needs as many fixtures, found {len(fixtures)}")
+    workers = {
+        "separate": args.separate_workers,
+        "align": args.align_workers,
+        "render": args.render_workers,
+    }
+
+    results = {}
+    for mode in ("sequential", "pipelined"):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            input_cache = os.path.join(cache_dir, "inputs")
+            output_cache = os.path.join(cache_dir, "outputs")
+            os.makedirs(input_cache)
+            os.makedirs(output_cache)
+            config = Config(input_cache, output_cache, args.vocal_separator_model)
+            config.production_type = args.production_type
+            generator = LyricsVideoGenerator(config)
+            task_configs = prepare_jobs(
+                fixtures, args.jobs, input_cache, args.production_type
+            )
+
+            started = time.perf_counter()
+            if mode == "sequential":
+                run_sequential(generator, task_configs)
+            else:
+                run_pipelined(generator, task_configs, workers)
+            results[mode] = time.perf_counter() - started
+
+    print(f"{args.jobs} jobs from {len(fixtures)} fixtures, stage workers {workers}")
+    for mode, elapsed in results.items():
+        jobs_per_hour = args.jobs * 3600 / elapsed
+        print(f"{mode:>10}: {elapsed:8.1f}s {jobs_per_hour:8.1f} jobs/hour")
+    print(f"   speedup: {results['sequential'] / results['pipelined']:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""Render fps with no watermark, per-frame drawtext and the cached overlay.
+
+Usage: python benchmarks/watermark_fps.py --seconds 20 --resolution 1080x1920
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import ffmpeg
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config
+from video_builder import VideoBuilder
+
+
+def render(video, seconds, frame_rate):
+    """Encode like build_video into the null muxer and return the achieved fps."""
+    out = ffmpeg.output(
+        video, "-", format="null", vcodec="libx264", preset="fast", pix_fmt="yuv420p"
+    ).overwrite_output()
+    started = time.perf_counter()
+    out.run(capture_stdout=True, capture_stderr=True)
+    return seconds * frame_rate / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Watermark render benchmark")
+    parser.add_argument("--seconds", type=int, default=20)
+    parser.add_argument("--frame_rate", type=int, default=30)
+    parser.add_argument("--resolution", type=str, default="1080x1920")
+    args = parser.parse_args()
+    width, height = map(int, args.resolution.split("x"))
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        config = Config(cache_dir, cache_dir)
+        video_builder = VideoBuilder(config)
+
+        def source():
+            return ffmpeg.input(
+                f"testsrc2=size={width}x{height}:rate={args.frame_rate}",
+                format="lavfi",
+                t=args.seconds,
+            ).video
+
+        variants = {
+            "none": source(),
+            "drawtext": source().filter(
+                "drawtext",
+                text=config.overlay_text,
+                x=5,
+                y=5,
+                fontcolor="white",
+                fontsize="sqrt(w*h)*0.05",
+            ),
+            "overlay": video_builder.burn_overlays(source(), None, width, height),
+        }
+        print(f"{args.resolution}, {args.seconds}s at {args.frame_rate} fps")
+        for name, video in variants.items():
+            fps = render(video, args.seconds, args.frame_rate)
+            print(f"{name:>10}: {fps:7.1f} fps")
+
+
+if __name__ == "__main__":
+    main()
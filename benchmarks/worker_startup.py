@@ -0,0 +1,107 @@
+"""Memory and time-to-ready of forked preloaded workers vs independent ones.
+
+Independent workers are spawned processes that each load their own models.
+Forked workers come from a parent that loaded the models once. For every
+worker it reports the seconds until it can take a task and its private
+memory, i.e. what the worker adds on top of the pages it shares.
+
+Both modes run the models on the CPU, forked workers cannot use CUDA.
+
+Usage: python benchmarks/worker_startup.py --workers 4 --production_type music
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config
+from lyri_core import LyricsVideoGenerator
+from workers import WorkerPool, process_memory
+
+
+def make_config(args):
+    config = Config(args.inputs_cache, args.outputs_cache, args.vocal_separator_model)
+    config.gpu_on = False
+    config.use_whisper = args.production_type != "lyrics"
+    return config
+
+
+def load_and_wait(config, ready, done):
+    LyricsVideoGenerator(config).model_manager.preload()
+    ready.put(os.getpid())
+    done.wait()
+
+
+def run_independent(config, workers):
+    context = multiprocessing.get_context("spawn")
+    ready = context.Queue()
+    done = context.Event()
+    started = time.perf_counter()
+    processes = [
+        context.Process(target=load_and_wait, args=(config, ready, done))
+        for _ in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    ready_times = {}
+    for _ in processes:
+        ready_times[ready.get()] = time.perf_counter() - started
+    memory = {pid: process_memory(pid) for pid in ready_times}
+    done.set()
+    for process in processes:
+        process.join()
+    return ready_times, memory
+
+
+def run_forked(config, workers):
+    started = time.perf_counter()
+    pool = WorkerPool(config, workers)
+    load_time = time.perf_counter() - started
+    while len(pool.ready_times) < workers:
+        time.sleep(0.01)
+    memory = {pid: process_memory(pid) for pid in pool.ready_times}
+    pool.shutdown()
+    return load_time, pool.ready_times, memory
+
+
+def report(title, ready_times, memory):
+    print(title)
+    for pid, seconds in sorted(ready_times.items(), key=lambda item: item[1]):
+        rss = memory[pid]["rss"] / 1024**2
+        private = memory[pid]["private"] / 1024**2
+        print(
+            f"  pid {pid}: ready in {seconds:6.2f}s, "
+            f"RSS {rss:7.0f} MiB, private {private:7.0f} MiB"
+        )
+    total_private = sum(m["private"] for m in memory.values()) / 1024**2
+    print(f"  total private: {total_private:.0f} MiB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Worker startup benchmark")
+    parser.add_argument("--workers", default=2, type=int)
+    parser.add_argument("--production_type", default="music", type=str)
+    parser.add_argument("--inputs_cache", default="./input_cache", type=str)
+    parser.add_argument("--outputs_cache", default="./aligner_cache", type=str)
+    parser.add_argument(
+        "--vocal_separator_model",
+        default="./checkpoints/vocal_separator/Kim_Vocal_2.onnx",
+        type=str,
+    )
+    args = parser.parse_args()
+    config = make_config(args)
+
+    ready_times, memory = run_independent(config, args.workers)
+    report("Independent workers (each loads the models)", ready_times, memory)
+
+    load_time, ready_times, memory = run_forked(config, args.workers)
+    print(f"Parent loaded the models in {load_time:.2f}s")
+    report("Forked workers (after the parent loaded)", ready_times, memory)
+
+
+if __name__ == "__main__":
+    main()
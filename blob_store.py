@@ -0,0 +1,66 @@
+import logging
+import os
+import re
+import shutil
+import uuid
+
+SHA256_PATTERN = re.compile(r"[0-9a-f]{64}")
+
+
+class BlobStore:
+    """Content addressed files, stored once under their sha256.
+
+    Blobs live in root/ab/cd/<sha256>, sharded by the first bytes of the
+    hash so no directory grows too large. Tasks get hard links to them,
+    which cost no extra space; on filesystems without hard links they get
+    a copy instead.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.partials_path = os.path.join(root, "partials")
+        os.makedirs(self.partials_path, exist_ok=True)
+
+    @staticmethod
+    def is_hash(sha256):
+        return bool(SHA256_PATTERN.fullmatch(sha256))
+
+    def path(self, sha256):
+        if not self.is_hash(sha256):
+            raise ValueError(f"Not a sha256 hex digest: {sha256}")
+        return os.path.join(self.root, sha256[:2], sha256[2:4], sha256)
+
+    def exists(self, sha256):
+        return os.path.exists(self.path(sha256))
+
+    def size(self, sha256):
+        return os.path.getsize(self.path(sha256))
+
+    def partial_path(self):
+        """A fresh path on the store's filesystem to write an upload into."""
+        return os.path.join(self.partials_path, f"{uuid.uuid4().hex}.partial")
+
+    def put(self, partial_path, sha256):
+        """Move a written file into the store, or drop it if already stored."""
+        blob_path = self.path(sha256)
+        if os.path.exists(blob_path):
+            os.remove(partial_path)
+            return blob_path
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        os.replace(partial_path, blob_path)
+        return blob_path
+
+    def link(self, sha256, target_path):
+        """Expose a blob at target_path, replacing what was there."""
+        blob_path = self.path(sha256)
+        # rename() leaves both names in place when they share an inode
+        if os.path.exists(target_path) and os.path.samefile(blob_path, target_path):
+            return target_path
+        temporary_path = f"{target_path}.{uuid.uuid4().hex}.link"
+        try:
+            os.link(blob_path, temporary_path)
+        except OSError as e:
+            logging.warning(f"Copying blob {sha256[:12]}, cannot hard link: {e}")
+            shutil.copyfile(blob_path, temporary_path)
+        os.replace(temporary_path, target_path)
+        return target_path
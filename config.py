@@ -1,3 +1,8 @@
+import copy
+import hashlib
+import json
+
+
 class Config:
     def __init__(
         self,
@@ -5,6 +10,8 @@ class Config:
         output_cache,
         vocal_separator_model="./checkpoints/vocal_separator/Kim_Vocal_2.onnx",
     ):
+        self.task_id = None  # Names the stage manifest, derived when None
+        self.input_hashes = {}  # File name -> {sha256, size, mtime_ns} of uploads
         self.audio_file_name = None
         self.text_file_name = None
         self.background_file_name = None
@@ -16,14 +23,62 @@ class Config:
             "|os_task_vad_threshold=0.5|os_task_file_force_overwrite=1"
         )
         self.overlay_text = "by Lyri.ai"
+        self.overlay_font = "DejaVuSans.ttf"
+        self.overlay_logo = None  # Image composited in the top right corner
         self.production_type = "music"
         self.gpu_on = True
         self.aspect_ratio = "horizontal"
         self.video_resolution = (1920, 1080)
+        self.extra_resolutions = []  # Rendered alongside video_resolution
         self.use_whisper = True
+        self.model_memory_budget_mb = None  # Unload idle models to stay below it
+        self.model_idle_ttl = None  # Seconds before an unused model is unloaded
         self.default_background_path = "./default.jpg"
+        self.progress_tracker = None
+        self.profile = False  # cProfile/tracemalloc/ffmpeg -benchmark the task
+        self.profiler = None
+        self.stage_workers = {}  # Per-stage pool sizes, e.g. {"render": 2}
+        self.worker_processes = 1  # Server processes that run tasks
+        self.tasks_per_worker = 1  # Concurrent tasks of a worker process
+        self.max_queue_depth = 16  # Tasks waiting for a worker, None is unbounded
+        self.max_upload_mb = 1024  # Per upload request, no limit when None
+        self.blob_store_path = None  # Server input blobs, input_cache/blobs by default
+        self.task_db_path = None  # Server task store, output_cache by default
+        self.task_ttl = None  # Seconds before finished tasks are forgotten
+        self.preview = False
+        self.preview_range = None  # (start, end) seconds, first lyrics if None
+        self.preview_scale = 0.5
+        self.subtitles_mode = "burn"  # "burn" into frames or "soft" track
+        self.output_container = "mp4"  # "mp4" or "mkv"
+        self.mp4_mode = "faststart"  # "faststart", "fragmented" or None
+        self.hls = False
+        self.hls_segment_type = "mpegts"  # "mpegts" or "fmp4"
+        self.hls_ladder = []  # Extra renditions as scales of the resolution
+
+    # Task level settings, persisted in stage manifests to resume a task
+    USER_DATA_FIELDS = (
+        "task_id",
+        "audio_file_name",
+        "text_file_name",
+        "background_file_name",
+        "production_type",
+        "aspect_ratio",
+        "video_resolution",
+        "extra_resolutions",
+        "preview",
+        "preview_range",
+        "preview_scale",
+        "subtitles_mode",
+        "output_container",
+        "mp4_mode",
+        "hls",
+        "hls_segment_type",
+        "hls_ladder",
+        "profile",
+    )
 
     def from_user_data(self, user_data: dict):
+        self.task_id = user_data.get("task_id")
         self.audio_file_name = user_data.get("audio_file_name")
         self.text_file_name = user_data.get("text_file_name")
         self.background_file_name = user_data.get("background_file_name")
@@ -32,6 +87,48 @@ class Config:
         self.production_type = user_data.get("production_type", "music")
         self.aspect_ratio = user_data.get("aspect_ratio", self.aspect_ratio)
         self.video_resolution = user_data.get("video_resolution", self.video_resolution)
+        self.extra_resolutions = user_data.get("extra_resolutions", [])
+        self.preview = user_data.get("preview", False)
+        self.preview_range = user_data.get("preview_range")
+        self.preview_scale = user_data.get("preview_scale", self.preview_scale)
+        self.subtitles_mode = user_data.get("subtitles_mode", self.subtitles_mode)
+        self.output_container = user_data.get("output_container", self.output_container)
+        self.mp4_mode = user_data.get("mp4_mode", self.mp4_mode)
+        self.hls = user_data.get("hls", self.hls)
+        self.hls_segment_type = user_data.get("hls_segment_type", self.hls_segment_type)
+        self.hls_ladder = user_data.get("hls_ladder", self.hls_ladder)
+        self.profile = user_data.get("profile", False)
+        self.input_hashes = dict(user_data.get("input_hashes") or {})
+
+    def to_user_data(self):
+        return {field: getattr(self, field) for field in self.USER_DATA_FIELDS}
+
+    def get_options_hash(self):
+        """Short hash of the task settings, differs between tasks on one audio."""
+        options = json.dumps(self.to_user_data(), sort_keys=True)
+        return hashlib.sha256(options.encode()).hexdigest()[:12]
+
+    def get_output_name(self):
+        """Base name of the task's subtitles and renders."""
+        return f"{self.audio_file_name}-{self.get_options_hash()}"
+
+    def freeze(self, **overrides):
+        """Return a read-only copy holding one task's settings.
+
+        Option lists are copied too, so changing the original while the task
+        runs (e.g. the next request reusing it) cannot leak into the task.
+        """
+        frozen = copy.copy(self)
+        for field in self.USER_DATA_FIELDS:
+            frozen.__dict__[field] = copy.deepcopy(getattr(self, field))
+        frozen.__dict__.update(overrides)
+        frozen.__dict__["_frozen"] = True
+        return frozen
+
+    def __setattr__(self, name, value):
+        if self.__dict__.get("_frozen"):
+            raise AttributeError(f"Task config is read-only, cannot set {name}")
+        super().__setattr__(name, value)
 
     def from_args(self, args):
         self.audio_file_name = args.audio
@@ -0,0 +1,145 @@
+import asyncio
+import os
+from email.utils import formatdate, parsedate_to_datetime
+from urllib.parse import quote
+from fastapi.responses import Response
+
+CHUNK_SIZE = 1024 * 1024
+ZERO_COPY_EXTENSION = "http.response.zerocopysend"
+
+
+def parse_range(header, size):
+    """Return (start, end) of a single "bytes=" range, end inclusive.
+
+    Returns None when the whole file should be sent: no header, another
+    unit, several ranges or a malformed one, which RFC 9110 says to ignore.
+    Raises ValueError when the range is outside the file.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, _, last = header[len("bytes=") :].strip().partition("-")
+    if not (first or last) or not all(part.isdigit() for part in (first, last) if part):
+        return None
+    if first and last and int(last) < int(first):
+        return None
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    else:
+        # Suffix range, the last N bytes
+        start = max(size - int(last), 0) if int(last) else size
+        end = size - 1
+    if start >= size or end < start:
+        raise ValueError(f"Range {header} outside of {size} bytes")
+    return start, end
+
+
+def etag_matches(header, etag):
+    """Weak comparison of an If-None-Match header with an ETag."""
+    tags = [tag.strip().removeprefix("W/") for tag in header.split(",")]
+    return "*" in tags or etag in tags
+
+
+def not_modified_since(header, mtime):
+    try:
+        return int(mtime) <= parsedate_to_datetime(header).timestamp()
+    except (TypeError, ValueError):
+        return False
+
+
+class ArtifactResponse(Response):
+    """Serves a finished file with ETag, conditional GET and byte ranges.
+
+    The ETag is the file's content hash. Bodies go out through the ASGI
+    zero-copy send extension (sendfile) when the server offers it, and in
+    chunks read off the event loop otherwise.
+    """
+
+    def __init__(self, request, file_path, etag, filename=None):
+        stat = os.stat(file_path)
+        self.file_path = file_path
+        self.send_body = request.method != "HEAD"
+        self.range = None
+        last_modified = formatdate(stat.st_mtime, usegmt=True)
+        headers = {
+            "ETag": etag,
+            "Last-Modified": last_modified,
+            "Accept-Ranges": "bytes",
+            # Clients may keep the file but must revalidate it with the ETag
+            "Cache-Control": "no-cache",
+        }
+        if filename:
+            headers["Content-Disposition"] = (
+                f"attachment; filename*=utf-8''{quote(filename)}"
+            )
+
+        if_none_match = request.headers.get("if-none-match")
+        if_modified_since = request.headers.get("if-modified-since")
+        if (if_none_match and etag_matches(if_none_match, etag)) or (
+            not if_none_match
+            and if_modified_since
+            and not_modified_since(if_modified_since, stat.st_mtime)
+        ):
+            status_code = 304
+            self.send_body = False
+        else:
+            status_code = 200
+            headers["Content-Length"] = str(stat.st_size)
+            range_header = request.headers.get("range")
+            if_range = request.headers.get("if-range")
+            # A stale If-Range asks for the whole new file instead of a piece
+            if if_range and if_range not in (etag, last_modified):
+                range_header = None
+            try:
+                self.range = parse_range(range_header, stat.st_size)
+            except ValueError:
+                status_code = 416
+                self.send_body = False
+                headers["Content-Range"] = f"bytes */{stat.st_size}"
+                headers["Content-Length"] = "0"
+            if self.range:
+                start, end = self.range
+                status_code = 206
+                headers["Content-Range"] = f"bytes {start}-{end}/{stat.st_size}"
+                headers["Content-Length"] = str(end - start + 1)
+        self.size = stat.st_size
+        super().__init__(
+            status_code=status_code,
+            headers=headers,
+            media_type="application/octet-stream",
+        )
+
+    async def __call__(self, scope, receive, send):
+        await send(
+            {
+                "type": "http.response.start",
+                "status": self.status_code,
+                "headers": self.raw_headers,
+            }
+        )
+        if not self.send_body:
+            await send({"type": "http.response.body", "body": b""})
+            return
+        start, end = self.range or (0, self.size - 1)
+        with open(self.file_path, "rb") as f:
+            if ZERO_COPY_EXTENSION in scope.get("extensions", {}):
+                await send(
+                    {
+                        "type": ZERO_COPY_EXTENSION,
+                        "file": f,
+                        "offset": start,
+                        "count": end - start + 1,
+                    }
+                )
+                return
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = await asyncio.to_thread(f.read, min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send(
+                    {"type": "http.response.body", "body": chunk, "more_body": True}
+                )
+        await send({"type": "http.response.body", "body": b""})
@@ -1,8 +1,10 @@
 import requests
 import json
 import os
+import time
 import asyncio
 import logging
+from hashing import hash_file
 
 
 class VideoAlignerClient:
@@ -15,21 +17,43 @@ class VideoAlignerClient:
         self.input_chache = input_chache
 
     def upload_files(self, file_paths, keys):
-        """Uploads multiple files to the FastAPI server."""
-        url = f"{self.api_url}/upload/"
-        files = [
-            (
-                "files",
-                (
-                    os.path.basename(file_path),
-                    open(os.path.join(self.input_chache, file_path), "rb"),
-                ),
-            )
-            for file_path in file_paths
-        ]
-        data = {"keys": keys}
-        response = requests.post(url, files=files, data=data)
-        return response.json()
+        """Uploads multiple files, attaching those the server already stores."""
+        stored = []
+        missing = []
+        for file_path, key in zip(file_paths, keys):
+            full_path = os.path.join(self.input_chache, file_path)
+            sha256 = hash_file(full_path)
+            response = requests.head(f"{self.api_url}/blobs/{sha256}")
+            if response.status_code == 200:
+                stored.append((sha256, key, os.path.basename(file_path)))
+            else:
+                missing.append((full_path, key))
+
+        response = {}
+        if missing:
+            url = f"{self.api_url}/upload/"
+            files = [
+                ("files", (os.path.basename(full_path), open(full_path, "rb")))
+                for full_path, _ in missing
+            ]
+            data = {"keys": [key for _, key in missing]}
+            response = requests.post(url, files=files, data=data).json()
+            for _, (_, file) in files:
+                file.close()
+        if stored:
+            self.logger.info(f"Skipping upload of {len(stored)} stored files")
+            url = f"{self.api_url}/attach/"
+            data = {
+                "hashes": [sha256 for sha256, _, _ in stored],
+                "keys": [key for _, key, _ in stored],
+                "file_names": [file_name for _, _, file_name in stored],
+            }
+            if "task_id" in response:
+                data["task_id"] = response["task_id"]
+            elif missing:
+                return response
+            response = requests.post(url, data=data).json()
+        return response
 
     def upload_metadata(self, task_id, metadata):
         """Uploads metadata for a specific task."""
@@ -43,12 +67,36 @@ class VideoAlignerClient:
         response = requests.get(url)
         return response.json()
 
-    def run_task(self, task_id):
-        """Starts processing the uploaded files."""
-        url = f"{self.api_url}/run/{task_id}"
-        response = requests.get(url)
+    def wait_for_task(self, task_id, timeout=10):
+        """Waits up to timeout seconds for the task to finish, returns its status."""
+        url = f"{self.api_url}/wait/{task_id}"
+        response = requests.get(url, params={"timeout": timeout}, timeout=timeout + 30)
         return response.json()
 
+    def run_task(self, task_id, queue_timeout=1800):
+        """Starts processing the uploaded files.
+
+        While the server's queue is full, retries after the delay it asks
+        for, for up to queue_timeout seconds. Raises RuntimeError if the task
+        cannot be started.
+        """
+        url = f"{self.api_url}/run/{task_id}"
+        deadline = time.monotonic() + queue_timeout
+        while True:
+            response = requests.get(url)
+            if response.status_code == 200:
+                return response.json()
+            if response.status_code != 429:
+                raise RuntimeError(
+                    f"Could not start task {task_id}: "
+                    f"{response.status_code} {response.text}"
+                )
+            retry_after = int(response.headers.get("Retry-After", 10))
+            if time.monotonic() + retry_after > deadline:
+                raise RuntimeError(f"Server queue stayed full for task {task_id}")
+            self.logger.info(f"Server queue is full, retrying in {retry_after}s")
+            time.sleep(retry_after)
+
     def download_file(self, task_id, file_type, output_path):
         """Downloads a specific file type for a task."""
         url = f"{self.api_url}/download_file/{task_id}/{file_type}"
@@ -87,7 +135,13 @@ class VideoAlignerClient:
         response = requests.delete(url)
         return response.json()
 
-    async def align(self, audio_file_path, meta_data, background_file_path=None):
+    async def align(
+        self,
+        audio_file_path,
+        meta_data,
+        background_file_path=None,
+        progress_callback=None,
+    ):
         print("Starting alignment...")
         file_paths = [audio_file_path]
         keys = ["audio"]
@@ -114,19 +168,24 @@ class VideoAlignerClient:
 
         # Start processing
         self.logger.info("Starting processing...")
-        run_response = self.run_task(task_id)
+        try:
+            run_response = await asyncio.to_thread(self.run_task, task_id)
+        except RuntimeError as e:
+            self.logger.error(str(e))
+            self.delete_task(task_id)
+            return None
         self.logger.info("Response: %s", run_response)
 
-        # Check status until processing is done
+        # The server answers as soon as the task is done, or with its
+        # progress once the wait times out
         while True:
-            self.logger.info("Checking status...")
-            status_response = self.check_status(task_id)
+            status_response = await asyncio.to_thread(self.wait_for_task, task_id)
             self.logger.info("Status: %s", status_response)
 
             if status_response["status"] in ["Completed", "Failed"]:
                 break
-
-            await asyncio.sleep(5)  # Wait before checking again
+            if progress_callback:
+                await progress_callback(status_response)
 
         completed = False
         if status_response["status"] == "Completed":
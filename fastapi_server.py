@@ -2,15 +2,19 @@ from fastapi import (
     FastAPI,
     UploadFile,
     File,
-    BackgroundTasks,
     HTTPException,
     Form,
     Request,
 )
-from fastapi.responses import FileResponse
-import shutil
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
+import asyncio
+import hashlib
+import time
 import os
 import uuid
+from blob_store import BlobStore
+from downloads import ArtifactResponse
+from hashing import hash_file, remember_hash
 import uvicorn
 import logging
 import yaml
@@ -18,6 +22,11 @@ import argparse
 from lyri_core import LyricsVideoGenerator
 from fastapi.responses import JSONResponse
 from config import Config
+from singleflight import SingleFlight
+from workers import QueueFull, WorkerPool
+from metrics import REGISTRY
+from task_events import TaskEvents
+from task_store import TaskStore
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -25,6 +34,91 @@ logger = logging.getLogger(__name__)
 
 import json
 
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+FINISHED_STATUSES = ("Completed", "Failed")
+MAX_WAIT_TIMEOUT = 300
+SSE_KEEPALIVE = 15
+
+HLS_MEDIA_TYPES = {
+    ".m3u8": "application/vnd.apple.mpegurl",
+    ".ts": "video/mp2t",
+    ".m4s": "video/iso.segment",
+    ".mp4": "video/mp4",
+}
+
+
+def write_chunk(f, digest, chunk):
+    digest.update(chunk)
+    f.write(chunk)
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class UploadSizeLimit:
+    """Answers 413 to upload requests whose body passes max_bytes.
+
+    A Content-Length over the limit is refused before the body is read.
+    Otherwise the body is counted as it arrives, so chunked requests are
+    cut off too, before FastAPI has spooled the rest of the multipart body.
+    """
+
+    def __init__(self, app, max_bytes, paths=("/upload/",)):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.paths = paths
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or not self.max_bytes
+            or scope["path"] not in self.paths
+        ):
+            await self.app(scope, receive, send)
+            return
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length and int(content_length) > self.max_bytes:
+            await self.send_too_large(scope, send)
+            return
+
+        received = 0
+        too_large = False
+        response_started = False
+
+        async def counting_receive():
+            nonlocal received, too_large
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    too_large = True
+                    raise UploadTooLarge()
+            return message
+
+        async def guarded_send(message):
+            nonlocal response_started
+            # The app's answer to the aborted body is replaced by the 413
+            if too_large:
+                return
+            response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, counting_receive, guarded_send)
+        except Exception:
+            if not too_large:
+                raise
+        if too_large and not response_started:
+            await self.send_too_large(scope, send)
+
+    @staticmethod
+    async def send_too_large(scope, send):
+        response = JSONResponse(
+            status_code=413, content={"message": "Upload is too large"}
+        )
+        await response(scope, None, send)
+
 
 def read_json_file(file_path):
     with open(file_path, "r") as file:
@@ -33,35 +127,44 @@ def read_json_file(file_path):
     return data
 
 
-class TaskManager:
-    def __init__(self):
-        self.tasks = {}
-
-    def add_task(self, task_id, output_video_path):
-        self.tasks[task_id] = {
-            "output_file_path": output_video_path,
-            "status": "Processing",
-        }
-
-    def complete_task(self, task_id, output_video_path):
-        self.tasks[task_id]["output_file_path"] = output_video_path
-        self.tasks[task_id]["status"] = "Completed"
-        logger.info(f"Processing completed: {output_video_path} (Task ID: {task_id})")
-
-
 class AlignerServer:
     def __init__(self, config):
         self.config = config
-        self.generator = LyricsVideoGenerator(self.config)
+        # Tasks run in worker processes, the API process only serves requests.
+        # It loads no models itself unless its workers are forked from it
+        self.worker_pool = WorkerPool(
+            self.config,
+            config.worker_processes,
+            config.max_queue_depth,
+            config.tasks_per_worker,
+        )
+        self.task_jobs = {}  # Task id -> job key, while queued or running
+        # Identical tasks submitted while one is running share its result
+        self.in_flight = SingleFlight()
+        self.max_upload_bytes = (
+            config.max_upload_mb * 1024**2 if config.max_upload_mb else None
+        )
 
         self.app = FastAPI()
+        self.app.add_middleware(UploadSizeLimit, max_bytes=self.max_upload_bytes)
         self.UPLOAD_DIR = config.input_cache or "input_cache"
         self.OUTPUT_DIR = config.output_cache or "output_cache"
         os.makedirs(self.UPLOAD_DIR, exist_ok=True)
         os.makedirs(self.OUTPUT_DIR, exist_ok=True)
-
-        self.task_manager = TaskManager()  # Dictionary to store task statuses
+        # Inputs are stored once by content, tasks get hard links to them
+        self.blob_store = BlobStore(
+            config.blob_store_path or os.path.join(self.UPLOAD_DIR, "blobs")
+        )
+
+        # Status streams and long polls wake up on every change of their task
+        self.task_events = TaskEvents()
+        self.task_store = TaskStore(
+            config.task_db_path or os.path.join(self.OUTPUT_DIR, "tasks.sqlite3"),
+            config.task_ttl,
+            on_change=self.task_events.notify,
+        )
         self.setup_routes()
+        self.resume_interrupted_tasks()
         logger.info("Aligner Server initialized")
 
     def setup_routes(self):
@@ -74,35 +177,45 @@ class AlignerServer:
             }
 
         @self.app.get("/run/{task_id}")
-        async def start_processing(task_id: str, background_tasks: BackgroundTasks):
-            """Start processing the uploaded file"""
-            if task_id not in self.task_manager.tasks:
+        async def start_processing(task_id: str):
+            """Queue the uploaded files for processing"""
+            task = self.task_store.get(task_id)
+            if task is None:
                 return JSONResponse(
                     status_code=404, content={"message": "Task ID not found"}
                 )
+            if self.worker_pool.is_full():
+                return self.queue_full_response()
 
-            task_info = self.task_manager.tasks[task_id]
-            if task_info["status"] != "Uploaded":
+            # Failed tasks can be run again and resume from their last stage
+            if not self.task_store.transition(
+                task_id, ("Uploaded", "Failed"), "Processing"
+            ):
                 return JSONResponse(
                     status_code=400,
                     content={"message": "File is not in 'Uploaded' status"},
                 )
 
-            # Process file in the background
-            background_tasks.add_task(self.process_file, task_id)
+            try:
+                await asyncio.to_thread(self.process_file, task_id)
+            except QueueFull:
+                self.task_store.update(task_id, status=task["status"])
+                return self.queue_full_response()
+            logger.info(f"Processing queued for task ID: {task_id}")
 
-            task_info["status"] = "Processing"
-            logger.info(f"Processing started for task ID: {task_id}")
-
-            return {"task_id": task_id, "message": "Processing started"}
+            return {
+                "task_id": task_id,
+                "message": "Processing started",
+                "queue_position": self.get_queue_position(task_id),
+            }
 
         @self.app.post("/upload-meta/{task_id}")
         async def receive_metadata(task_id: str, request: Request):
-            task = self.task_manager.tasks.get(task_id)
-            if task is None:
-                raise HTTPException(status_code=404, detail="Task not found")
             json_data = await request.json()
-            task["input_files"]["meta"] = json.loads(json_data)
+            if not self.task_store.merge(
+                task_id, "input_files", {"meta": json.loads(json_data)}
+            ):
+                raise HTTPException(status_code=404, detail="Task not found")
             logging.info(f"Received metadata for task {task_id}: {json_data}")
             # Process the JSON data as needed
             return JSONResponse(
@@ -118,15 +231,8 @@ class AlignerServer:
             """Upload multiple files and associate them with a task using keys"""
             if not task_id:
                 task_id = str(uuid.uuid4())  # Generate a unique task ID if not provided
-
-            if task_id not in self.task_manager.tasks:
-                self.task_manager.tasks[task_id] = {
-                    "status": "Uploaded",
-                    "input_files": {},
-                    "output_file_path": None,
-                }
-
-            task_info = self.task_manager.tasks[task_id]
+            if task_id != os.path.basename(task_id):
+                raise HTTPException(status_code=400, detail="Invalid task ID")
 
             if len(files) != len(keys):
                 return JSONResponse(
@@ -134,33 +240,103 @@ class AlignerServer:
                     content={"message": "Number of files and keys must match"},
                 )
 
+            self.task_store.create(task_id)
+            uploaded = {}
             for file, key in zip(files, keys):
-                input_file_path = os.path.join(self.UPLOAD_DIR, file.filename)
-
-                # Save file
-                with open(input_file_path, "wb") as buffer:
-                    shutil.copyfileobj(file.file, buffer)
-
-                # Store file info with key
-                task_info["input_files"][key] = file.filename
-
-                logger.info(
-                    f"File uploaded: {input_file_path} (Task ID: {task_id}, Key: {key})"
+                # Save file once per content, hashing it on the way
+                sha256 = await self.save_upload(file)
+                uploaded[key] = self.attach_blob(task_id, key, sha256, file.filename)
+
+            return {"task_id": task_id, "message": "Files uploaded", "files": uploaded}
+
+        @self.app.api_route("/blobs/{sha256}", methods=["GET", "HEAD"])
+        async def check_blob(sha256: str):
+            """Tell whether an input is stored already, so it need not be uploaded"""
+            if not self.blob_store.is_hash(sha256) or not self.blob_store.exists(
+                sha256
+            ):
+                raise HTTPException(status_code=404, detail="Blob not found")
+            return {"sha256": sha256, "size": self.blob_store.size(sha256)}
+
+        @self.app.post("/attach/")
+        async def attach_files(
+            task_id: str = Form(None),
+            hashes: list[str] = Form(...),
+            keys: list[str] = Form(...),
+            file_names: list[str] = Form(...),
+        ):
+            """Associate stored inputs with a task by sha256 instead of uploading"""
+            if not task_id:
+                task_id = str(uuid.uuid4())
+            if task_id != os.path.basename(task_id):
+                raise HTTPException(status_code=400, detail="Invalid task ID")
+            if not len(hashes) == len(keys) == len(file_names):
+                return JSONResponse(
+                    status_code=400,
+                    content={"message": "Number of hashes, keys and names must match"},
                 )
+            for sha256 in hashes:
+                if not self.blob_store.is_hash(sha256) or not self.blob_store.exists(
+                    sha256
+                ):
+                    raise HTTPException(
+                        status_code=404, detail=f"Blob {sha256} not found"
+                    )
+
+            self.task_store.create(task_id)
+            attached = {}
+            for sha256, key, file_name in zip(hashes, keys, file_names):
+                attached[key] = self.attach_blob(task_id, key, sha256, file_name)
 
-            return {"task_id": task_id, "message": "Files uploaded"}
+            return {"task_id": task_id, "message": "Files attached", "files": attached}
 
         @self.app.get("/status/{task_id}")
         async def check_status(task_id: str):
             """Check the processing status of a task"""
-            task = self.task_manager.tasks.get(task_id)
+            task = self.task_store.get(task_id)
             if task is None:
                 raise HTTPException(status_code=404, detail="Task not found")
-            return {"task_id": task_id, "status": task["status"]}
+            return self.status_response(task)
+
+        @self.app.get("/wait/{task_id}")
+        async def wait_for_task(task_id: str, timeout: float = 30):
+            """Return the status once the task finishes, or after timeout seconds"""
+            deadline = time.monotonic() + min(max(timeout, 0), MAX_WAIT_TIMEOUT)
+            while True:
+                version = self.task_events.version(task_id)
+                task = self.task_store.get(task_id)
+                if task is None:
+                    raise HTTPException(status_code=404, detail="Task not found")
+                remaining = deadline - time.monotonic()
+                if task["status"] in FINISHED_STATUSES or remaining <= 0:
+                    return self.status_response(task)
+                await self.task_events.wait(task_id, version, remaining)
+
+        @self.app.get("/events/{task_id}")
+        async def stream_events(task_id: str):
+            """Push stage, progress and completion events as Server-Sent Events"""
+            if self.task_store.get(task_id) is None:
+                raise HTTPException(status_code=404, detail="Task not found")
+            return StreamingResponse(
+                self.task_event_stream(task_id),
+                media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+            )
 
-        @self.app.get("/download_file/{task_id}/{file_type}")
-        async def download_file(task_id: str, file_type: str):
-            task = self.task_manager.tasks.get(task_id)
+        @self.app.api_route(
+            "/download_file/{task_id}/{file_type}", methods=["GET", "HEAD"]
+        )
+        async def download_file(task_id: str, file_type: str, request: Request):
+            task = self.task_store.get(task_id)
+            if task and task["status"] == "Processing":
+                # Fragmented MP4s can be streamed while they are still encoding
+                live_artifacts = task["progress"].get("artifacts", {})
+                file_path = live_artifacts.get(file_type)
+                if file_path and os.path.exists(file_path):
+                    return StreamingResponse(
+                        self.stream_growing_file(task_id, file_path),
+                        media_type="video/mp4",
+                    )
             if not task or task["status"] != "Completed":
                 raise HTTPException(status_code=404, detail="Task not completed")
             results = task["results"]
@@ -173,15 +349,44 @@ class AlignerServer:
             if not os.path.exists(file_path):
                 raise HTTPException(status_code=404, detail="File not found")
 
+            # Hashed once per file and process, memoized while it is unchanged
+            etag = f'"{await asyncio.to_thread(hash_file, file_path)}"'
+            return ArtifactResponse(
+                request, file_path, etag, filename=os.path.basename(file_path)
+            )
+
+        @self.app.get("/hls/{task_id}/{file_name}")
+        async def download_hls_file(task_id: str, file_name: str):
+            """Serve HLS playlists and segments, also while still rendering"""
+            task = self.task_store.get(task_id)
+            if task is None:
+                raise HTTPException(status_code=404, detail="Task not found")
+            playlist_path = task["results"].get("hls_playlist_path") or (
+                task["progress"].get("artifacts", {}).get("hls_playlist_path")
+            )
+            if not playlist_path:
+                raise HTTPException(status_code=404, detail="No HLS output for task")
+
+            if file_name != os.path.basename(file_name):
+                raise HTTPException(status_code=400, detail="Invalid file name")
+            file_path = os.path.join(os.path.dirname(playlist_path), file_name)
+            if not os.path.exists(file_path):
+                raise HTTPException(status_code=404, detail="File not found")
+
             return FileResponse(
                 file_path,
-                media_type="application/octet-stream",
-                filename=os.path.basename(file_path),
+                media_type=HLS_MEDIA_TYPES.get(
+                    os.path.splitext(file_name)[1], "application/octet-stream"
+                ),
+                # Playlists change while segments are appended
+                headers={"Cache-Control": "no-cache"}
+                if file_name.endswith(".m3u8")
+                else None,
             )
 
         @self.app.post("/download_all/{task_id}")
         async def download_all(task_id: str):
-            task = self.task_manager.tasks.get(task_id)
+            task = self.task_store.get(task_id)
             if not task or task["status"] != "Completed":
                 raise HTTPException(status_code=404, detail="Task not completed")
             results = task["results"]
@@ -190,22 +395,139 @@ class AlignerServer:
                 files.append({"file_type": key, "file_path": value})
             return files
 
+        @self.app.get("/metrics")
+        async def metrics():
+            """Stage timings, cache hits and job outcomes for Prometheus"""
+            return PlainTextResponse(
+                REGISTRY.render(), media_type="text/plain; version=0.0.4"
+            )
+
         @self.app.get("/list_tasks")
-        async def list_tasks():
-            """List all tasks"""
-            return self.task_manager.tasks.keys()
+        async def list_tasks(
+            status: str = None,
+            created_after: float = None,
+            limit: int = 50,
+            offset: int = 0,
+        ):
+            """List tasks, newest first, optionally filtered by status"""
+            limit = min(max(limit, 1), 500)
+            tasks, total = self.task_store.list(
+                status, created_after, limit, max(offset, 0)
+            )
+            return {"tasks": tasks, "total": total, "limit": limit, "offset": offset}
 
         @self.app.delete("/delete/{task_id}")
         async def delete_task(task_id: str):
             """Delete task and remove associated files"""
-            task = self.task_manager.tasks.pop(task_id, None)
-            if task is None:
+            if not self.task_store.delete(task_id):
                 raise HTTPException(status_code=404, detail="Task not found")
             return {"task_id": task_id, "message": "Task deleted successfully"}
 
-    def process_file(self, task_id: str):
-        """Process the uploaded file asynchronously"""
-        task = self.task_manager.tasks.get(task_id)
+    async def save_upload(self, file):
+        """Stream an upload into the blob store and return its sha256.
+
+        Chunks are hashed and written in one pass, off the event loop. The
+        size limit is enforced on the request body by UploadSizeLimit.
+        """
+        digest = hashlib.sha256()
+        partial_path = self.blob_store.partial_path()
+        try:
+            with open(partial_path, "wb") as f:
+                while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                    await asyncio.to_thread(write_chunk, f, digest, chunk)
+            sha256 = digest.hexdigest()
+            self.blob_store.put(partial_path, sha256)
+        finally:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+        return sha256
+
+    def attach_blob(self, task_id, key, sha256, file_name):
+        """Link a stored input into the task's inputs under key"""
+        # Named after the task, tasks sharing a file name do not collide
+        file_name = f"{task_id}_{os.path.basename(file_name)}"
+        input_file_path = self.blob_store.link(
+            sha256, os.path.join(self.UPLOAD_DIR, file_name)
+        )
+        stat = os.stat(input_file_path)
+        stamp = {"sha256": sha256, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+        remember_hash(input_file_path, sha256, stat.st_size, stat.st_mtime_ns)
+
+        self.task_store.merge(task_id, "input_files", {key: file_name})
+        self.task_store.merge(task_id, "input_hashes", {key: stamp})
+        logger.info(
+            f"File attached: {input_file_path} (Task ID: {task_id}, Key: {key})"
+        )
+        return {"sha256": sha256, "size": stat.st_size}
+
+    async def stream_growing_file(self, task_id, file_path, chunk_size=1024 * 1024):
+        """Yield a file that is still being written until its task finishes."""
+        with open(file_path, "rb") as f:
+            while True:
+                chunk = await asyncio.to_thread(f.read, chunk_size)
+                if chunk:
+                    yield chunk
+                elif self.is_processing(task_id):
+                    await asyncio.sleep(0.5)
+                else:
+                    # Flush whatever was written between the last read and the end
+                    while chunk := await asyncio.to_thread(f.read, chunk_size):
+                        yield chunk
+                    return
+
+    def is_processing(self, task_id):
+        task = self.task_store.get(task_id)
+        return task is not None and task["status"] == "Processing"
+
+    def status_response(self, task):
+        response = {"task_id": task["task_id"], "status": task["status"]}
+        response.update(task["progress"])
+        if task["status"] == "Processing":
+            response["queue_position"] = self.get_queue_position(task["task_id"])
+        return response
+
+    async def task_event_stream(self, task_id):
+        """Yield an SSE event per change of the task until it finishes."""
+        last_status = last_stage = None
+        while True:
+            version = self.task_events.version(task_id)
+            task = self.task_store.get(task_id)
+            if task is None:
+                yield f"event: deleted\ndata: {json.dumps({'task_id': task_id})}\n\n"
+                return
+            response = self.status_response(task)
+            if task["status"] in FINISHED_STATUSES:
+                event = task["status"].lower()
+            elif task["status"] != last_status or response.get("stage") != last_stage:
+                event = "stage"
+            else:
+                event = "progress"
+            last_status, last_stage = task["status"], response.get("stage")
+            yield f"event: {event}\ndata: {json.dumps(response)}\n\n"
+            if task["status"] in FINISHED_STATUSES:
+                return
+            if not await self.task_events.wait(task_id, version, SSE_KEEPALIVE):
+                # A comment keeps proxies from closing an idle stream
+                yield ": keep-alive\n\n"
+
+    def queue_full_response(self):
+        return JSONResponse(
+            status_code=429,
+            content={"message": "Too many tasks queued, retry later"},
+            headers={"Retry-After": str(self.worker_pool.retry_after())},
+        )
+
+    def get_queue_position(self, task_id):
+        """1-based place in the job queue, 0 while running, None if unknown"""
+        job_key = self.task_jobs.get(task_id)
+        return self.worker_pool.position(job_key) if job_key else None
+
+    def process_file(self, task_id: str, bounded=True):
+        """Queue the task on the workers; its record is updated when it ends
+
+        Raises QueueFull when bounded and the job queue is full.
+        """
+        task = self.task_store.get(task_id)
         if not task:
             return
 
@@ -216,26 +538,67 @@ class AlignerServer:
             data = data["meta"]
             data["audio_file_name"] = input_file_path
             data["background_file_name"] = background
-
-            self.task_manager.tasks[task_id]["status"] = "Processing"
-            logger.info(
-                f"Processing started for {input_file_path} (Task ID: {task_id})"
-            )
+            data["task_id"] = task_id
+            data.setdefault("profile", self.config.profile)
+            files = task["input_files"]
+            data["input_hashes"] = {
+                files[key]: stamp
+                for key, stamp in task["input_hashes"].items()
+                if key in files
+            }
 
             task_config = Config(None, None)
             task_config.from_user_data(data)
-            result = self.generator.generate(task_config)
+            job_key = LyricsVideoGenerator.get_job_key(task_config, self.UPLOAD_DIR)
+            self.task_store.update(
+                task_id, status="Processing", started_at=time.time(), error=None
+            )
+
+            # A resent upload with the same options waits for the running task
+            future, joined = self.in_flight.submit(
+                job_key,
+                lambda publish: self.worker_pool.submit(
+                    data, progress_callback=publish, job_id=job_key, bounded=bounded
+                ),
+                progress_callback=lambda snapshot: self.task_store.update(
+                    task_id, progress=snapshot
+                ),
+            )
+        except QueueFull:
+            raise
+        except Exception as e:
+            self.task_store.update(
+                task_id, status="Failed", error=str(e), finished_at=time.time()
+            )
+            logger.error(f"Processing failed for {task_id}: {str(e)}")
+            return
+        if joined:
+            logger.info(f"Task {task_id} joined an identical running task")
+        self.task_jobs[task_id] = job_key
+        logger.info(f"Processing started for {input_file_path} (Task ID: {task_id})")
+        future.add_done_callback(lambda future: self.record_result(task_id, future))
+
+    def record_result(self, task_id, future):
+        """Store the artifacts of a finished task, or its failure"""
+        self.task_jobs.pop(task_id, None)
+        try:
+            result = future.result()
             logger.info("Pipeline completed")
+            # Artifacts were hashed by the worker, downloads get their ETag at once
+            for path, stamp in result.get("artifact_hashes", {}).items():
+                remember_hash(path, stamp["sha256"], stamp["size"], stamp["mtime_ns"])
 
             output_video_path = result.get("video_path")
             sync_file_path = result.get("subtitles_path")
             vocal_audio_full_path = result.get("vocal_path")
             instrumental_audio_full_path = result.get("instrumental_path")
             input_audio_path = result.get("audio_path")
+            hls_playlist_path = result.get("hls_path")
+            timings_path = result.get("timings_path")
+            profile_path = result.get("profile_path")
 
             logger.info("Processing completed")
-            self.task_manager.tasks[task_id]["results"] = {}
-            results = self.task_manager.tasks[task_id]["results"]
+            results = {}
             if sync_file_path:
                 results["sync_file_path"] = sync_file_path
                 logger.info(f"Artifact: {sync_file_path} (Task ID: {task_id})")
@@ -253,13 +616,58 @@ class AlignerServer:
             if input_audio_path:
                 results["input_audio_path"] = input_audio_path
                 logger.info(f"Artifact: {input_audio_path} (Task ID: {task_id})")
+            if hls_playlist_path:
+                results["hls_playlist_path"] = hls_playlist_path
+                logger.info(f"Artifact: {hls_playlist_path} (Task ID: {task_id})")
+            if timings_path:
+                results["timings"] = timings_path
+            if profile_path:
+                results["profile"] = profile_path
+            for resolution, extra_video_path in result.get(
+                "extra_video_paths", {}
+            ).items():
+                results[f"video_file_path_{resolution}"] = extra_video_path
+                logger.info(f"Artifact: {extra_video_path} (Task ID: {task_id})")
             if not any(results.values()):
                 raise Exception("Processing failed: No output artifacts generated")
-            self.task_manager.tasks[task_id]["status"] = "Completed"
+            self.task_store.update(
+                task_id, status="Completed", results=results, finished_at=time.time()
+            )
         except Exception as e:
-            self.task_manager.tasks[task_id]["status"] = "Failed"
+            self.task_store.update(
+                task_id, status="Failed", error=str(e), finished_at=time.time()
+            )
             logger.error(f"Processing failed for {task_id}: {str(e)}")
 
+    def resume_interrupted_tasks(self):
+        """Restart tasks a previous server process left in the middle of a stage"""
+        task_ids = []
+        offset = 0
+        while True:
+            tasks, total = self.task_store.list("Processing", limit=500, offset=offset)
+            task_ids.extend(task["task_id"] for task in tasks)
+            offset += len(tasks)
+            if not tasks or offset >= total:
+                break
+        # Tasks interrupted before the task store existed only have a manifest
+        for task_id, task_data in LyricsVideoGenerator.list_interrupted_tasks(
+            self.OUTPUT_DIR
+        ):
+            if self.task_store.create(task_id, status="Processing"):
+                self.task_store.update(
+                    task_id,
+                    input_files={
+                        "audio": task_data["audio_file_name"],
+                        "background": task_data["background_file_name"],
+                        "meta": task_data,
+                    },
+                )
+                task_ids.append(task_id)
+        for task_id in task_ids:
+            logger.info(f"Resuming interrupted task {task_id}")
+            # Tasks accepted before the restart are not turned away now
+            self.process_file(task_id, bounded=False)
+
     def run(self):
         """Start the FastAPI server"""
         uvicorn.run(self.app, host="0.0.0.0", port=8000, log_level="info")
@@ -290,6 +698,25 @@ if __name__ == "__main__":
         config_dict.get("paths", {}).get("input_cache", "input_cache"),
         config_dict.get("paths", {}).get("output_cache", "output_cache"),
     )
+    config.stage_workers = config_dict.get("stage_workers") or {}
+    queue_config = config_dict.get("queue") or {}
+    config.worker_processes = queue_config.get("workers", config.worker_processes)
+    config.tasks_per_worker = queue_config.get(
+        "tasks_per_worker", config.tasks_per_worker
+    )
+    config.max_queue_depth = queue_config.get("max_depth", config.max_queue_depth)
+    config.gpu_on = config_dict.get("aligner", {}).get("gpu_on", True)
+    config.profile = config_dict.get("profile", False)
+    config.max_upload_mb = (config_dict.get("uploads") or {}).get(
+        "max_mb", config.max_upload_mb
+    )
+    config.blob_store_path = config_dict.get("paths", {}).get("blob_store")
+    tasks_config = config_dict.get("tasks") or {}
+    config.task_db_path = tasks_config.get("db_path")
+    config.task_ttl = tasks_config.get("ttl")
+    models_config = config_dict.get("models") or {}
+    config.model_memory_budget_mb = models_config.get("memory_budget_mb")
+    config.model_idle_ttl = models_config.get("idle_ttl")
 
     server = AlignerServer(config)
     server.run()
@@ -25,6 +25,7 @@ import aiohttp
 import aiofiles
 import subprocess
 import time
+from progress import format_progress
 
 
 def start_local_server(api_id, api_hash):
@@ -230,13 +231,30 @@ async def save_image_file(context, image_file, input_cache, base_filename):
     return image_path
 
 
+async def update_status_message(status_message, snapshot):
+    """Edit the single status message in place, skipping unchanged text."""
+    text = format_progress(snapshot)
+    if text == status_message.text:
+        return status_message
+    try:
+        return await status_message.edit_text(text)
+    except Exception as e:
+        logging.getLogger(__name__).warning(f"Could not update status message: {e}")
+        return status_message
+
+
 async def align(
-    update: Update, context: ContextTypes.DEFAULT_TYPE, production_type: str
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    production_type: str,
+    preview: bool = False,
 ) -> None:
     logger = logging.getLogger(__name__)
     config = context.bot_data["config"]
     logger.info(f"Creting {production_type} video...")
-    await update.effective_chat.send_message("Doing magic now, please wait...")
+    status_message = await update.effective_chat.send_message(
+        "Doing magic now, please wait..."
+    )
 
     try:
         input_cache = config["paths"]["input_cache"]
@@ -301,7 +319,9 @@ async def align(
         data = {
             "production_type": production_type,
             "aspect_ratio": context.user_data.get("aspect_ratio", "vertical"),
+            "preview": preview,
             "video_resolution": context.user_data.get("video_resolution", (1920, 1080)),
+            "extra_resolutions": context.user_data.get("extra_resolutions", []),
         }
         if not production_type == "separate_audio":
             data["text_file_name"] = lyrics_file["file_name"] if lyrics_file else None
@@ -309,8 +329,12 @@ async def align(
         else:
             background_file_path = None
 
+        async def on_status(status):
+            nonlocal status_message
+            status_message = await update_status_message(status_message, status)
+
         result_paths = await api_client.align(
-            audio_file_name, data, background_file_path
+            audio_file_name, data, background_file_path, progress_callback=on_status
         )
 
         # result_paths = await asyncio.get_event_loop().run_in_executor(
@@ -324,13 +348,37 @@ async def align(
         vocal_audio_full_path = result_paths.get("vocal_path")
         instrumental_audio_full_path = result_paths.get("instrumental_path")
         input_audio_path = result_paths.get("audio_path")
+        extra_video_paths = {
+            key.removeprefix("video_file_path_"): path
+            for key, path in result_paths.items()
+            if key.startswith("video_file_path_")
+        }
 
+        if video_path and preview:
+            # Keep the context so the user can tweak the background and retry
+            with open(video_path, "rb") as video:
+                await update.effective_chat.send_video(
+                    video,
+                    caption="Here's a quick preview of your video!",
+                    supports_streaming=True,
+                )
+            await try_start_processing(update, context)
+            return
         if video_path:
             # Send the aligned video
             await update.effective_chat.send_message("Sending the aligned video...")
             with open(video_path, "rb") as video:
                 await update.effective_chat.send_video(
-                    video, caption="Here's your video with aligned lyrics!"
+                    video,
+                    caption="Here's your video with aligned lyrics!",
+                    supports_streaming=True,
+                )
+        for resolution, extra_video_path in extra_video_paths.items():
+            with open(extra_video_path, "rb") as video:
+                await update.effective_chat.send_video(
+                    video,
+                    caption=f"Here's the {resolution} version of your video!",
+                    supports_streaming=True,
                 )
         if subtitles_path:
             # Send the SRT subtitles file
@@ -497,6 +545,7 @@ async def try_start_processing(
                     "Horizontal Video", callback_data="horizontal_video"
                 ),
             ],
+            [InlineKeyboardButton("Both formats", callback_data="both_video")],
             [
                 InlineKeyboardButton(
                     "Drop context / Начать сначала", callback_data="drop_context"
@@ -518,6 +567,7 @@ async def try_start_processing(
                 InlineKeyboardButton("Music video", callback_data="music_align"),
                 InlineKeyboardButton("Karaoke video", callback_data="karaoke_align"),
             ],
+            [InlineKeyboardButton("Quick preview", callback_data="music_preview")],
             [
                 InlineKeyboardButton(
                     "Drop context / Начать сначала", callback_data="drop_context"
@@ -672,6 +722,11 @@ async def handle_callback_query(
             "You selected: Karaoke video 🎤. Processing will begin soon!"
         )
         await align(update, context, "karaoke")
+    elif query.data == "music_preview":
+        await query.edit_message_text(
+            "You selected: Quick preview 👀. Rendering a short excerpt..."
+        )
+        await align(update, context, "music", preview=True)
     elif query.data == "auto_subs":
         context.user_data["lyrics_file"] = None
         await query.edit_message_text(
@@ -682,13 +737,22 @@ async def handle_callback_query(
     elif query.data == "horizontal_video":
         context.user_data["aspect_ratio"] = "horizontal"
         context.user_data["video_resolution"] = (1920, 1080)
+        context.user_data["extra_resolutions"] = []
         await query.edit_message_text("You selected: Horizontal Video")
         await try_start_processing(update, context)
     elif query.data == "vertical_video":
         context.user_data["aspect_ratio"] = "vertical"
         context.user_data["video_resolution"] = (1080, 1920)
+        context.user_data["extra_resolutions"] = []
         await query.edit_message_text("You selected: Vertical Video")
         await try_start_processing(update, context)
+    elif query.data == "both_video":
+        # Rendered together, sharing one decode of the background and audio
+        context.user_data["aspect_ratio"] = "vertical"
+        context.user_data["video_resolution"] = (1080, 1920)
+        context.user_data["extra_resolutions"] = [(1920, 1080)]
+        await query.edit_message_text("You selected: Vertical + Horizontal Video")
+        await try_start_processing(update, context)
     elif query.data == "separate_audio":
         await query.edit_message_text(
             "You selected: Separate audio 🎤. Processing will begin soon!"
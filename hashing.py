@@ -0,0 +1,47 @@
+import hashlib
+import os
+import threading
+
+# Hashes of files already read in this process, keyed by (path, size, mtime)
+_hash_memo = {}
+_hash_memo_lock = threading.Lock()
+
+
+def hash_file(path, chunk_size=1024 * 1024):
+    """Return the sha256 hex digest of a file, memoized while it is unchanged."""
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    with _hash_memo_lock:
+        if key in _hash_memo:
+            return _hash_memo[key]
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    file_hash = digest.hexdigest()
+
+    with _hash_memo_lock:
+        _hash_memo[key] = file_hash
+    return file_hash
+
+
+def stamp_file(path):
+    """sha256, size and mtime of a file, for remember_hash in another process."""
+    stat = os.stat(path)
+    return {
+        "sha256": hash_file(path),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+    }
+
+
+def remember_hash(path, file_hash, size, mtime_ns):
+    """Record a hash computed while writing a file, so it is not read again.
+
+    size and mtime_ns are those of the file when it was hashed; if it has
+    changed since, hash_file reads it anyway.
+    """
+    key = (os.path.abspath(path), size, mtime_ns)
+    with _hash_memo_lock:
+        _hash_memo[key] = file_hash
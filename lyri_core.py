@@ -1,4 +1,8 @@
+import os
+import json
+import hashlib
 import logging
+from concurrent.futures import Future
 from aligners import LyricsAlignerWithWhisper, LyricsAligner
 import argparse
 from config import Config
@@ -10,70 +14,357 @@ logging.basicConfig(
 )
 
 
-from video_builder import VideoBuilder
 from audio_processor import AudioProcessor
+from progress import ProgressTracker
+from metrics import JOBS
+from models import ModelManager
+from pipeline import Pipeline, Stage, StageManifest, StageScheduler
+from singleflight import SingleFlight
+from hashing import hash_file, remember_hash
+
+INPUT_FILE_FIELDS = ("audio_file_name", "text_file_name", "background_file_name")
 
 
 class LyricsVideoGenerator:
     def __init__(self, config):
         self.config = config
-        self.audio_processor = AudioProcessor(config)
+        # One manager, so every model counts against the same memory budget
+        self.model_manager = ModelManager(
+            config.model_memory_budget_mb, config.model_idle_ttl
+        )
+        self.audio_processor = AudioProcessor(config, self.model_manager)
         if config.use_whisper:
-            self.lyrics_aligner = LyricsAlignerWithWhisper(config)
+            self.lyrics_aligner = LyricsAlignerWithWhisper(config, self.model_manager)
         else:
             self.lyrics_aligner = LyricsAligner(config)
+        # Imported here, ffmpeg and Pillow are not needed to import this module
+        from video_builder import VideoBuilder
+
         self.video_builder = VideoBuilder(config)
+        self.manifests_path = os.path.join(config.output_cache, "manifests")
+        # Identical tasks submitted while one is running share its result
+        self.in_flight = SingleFlight()
 
     def generate(self, task_config: Config):
+        """Run a task; safe to call from several threads at once."""
+        task_config, pipeline, context, manifest = self.prepare(task_config)
+        try:
+            context = pipeline.run(
+                task_config, context, manifest, task_config.progress_tracker
+            )
+        except Exception:
+            self.finish(None, task_config, manifest, outcome="error")
+            raise
+        return self.finish(context, task_config, manifest)
+
+    def submit(self, task_config: Config, scheduler: StageScheduler):
+        """Queue the task's stages on a scheduler; the future yields the result."""
+        task_config, pipeline, context, manifest = self.prepare(task_config)
+        job = scheduler.submit(
+            pipeline, task_config, context, manifest, task_config.progress_tracker
+        )
+        future = Future()
+
+        def on_done(job):
+            try:
+                context = job.result()
+            except Exception as e:
+                self.finish(None, task_config, manifest, outcome="error")
+                future.set_exception(e)
+                return
+            try:
+                future.set_result(self.finish(context, task_config, manifest))
+            except Exception as e:
+                future.set_exception(e)
+
+        job.add_done_callback(on_done)
+        return future
+
+    def prepare(self, task_config: Config):
+        task_id = self.get_task_id(task_config)
+        # Hashed during the upload, the caches need not read the inputs again
+        for file_name, stamp in task_config.input_hashes.items():
+            remember_hash(
+                os.path.join(self.config.input_cache, file_name),
+                stamp["sha256"],
+                stamp["size"],
+                stamp["mtime_ns"],
+            )
+        # Profiling is opt-in, tasks without the flag run untouched
+        profiler = None
+        if task_config.profile:
+            from profiling import TaskProfiler
+
+            profiler = TaskProfiler(
+                os.path.join(self.config.output_cache, "profiles", task_id)
+            )
+        # Stages only see a read-only copy, so tasks cannot leak into each other
+        task_config = task_config.freeze(
+            progress_tracker=task_config.progress_tracker or ProgressTracker(),
+            profiler=profiler,
+        )
+        pipeline = self.build_pipeline(task_config)
+        task_config.progress_tracker.plan(pipeline.stage_names)
+
+        manifest = StageManifest(self.get_manifest_path(task_id))
+        context = task_config.to_user_data()
+        context["options"] = task_config.to_user_data()
+        # Files are saved again under the same name, stages compare their content
+        input_hashes = self.get_input_hashes(task_config, self.config.input_cache)
+        for field, file_hash in input_hashes.items():
+            context[f"{field}_hash"] = file_hash
+        return task_config, pipeline, context, manifest
+
+    def finish(self, context, task_config: Config, manifest, outcome=None):
+        """Count the outcome, write the timing record and return the result."""
+        outcome = outcome or ("completed" if context is not None else "failed")
+        JOBS.inc(outcome=outcome)
+        timings_path = self.write_timing_record(task_config, manifest, outcome)
+        profile_path = None
+        if task_config.profiler:
+            profile_path = task_config.profiler.write(manifest.data.get("timings"))
+        if context is None:
+            logging.error("Video generation failed.")
+            return None
+
+        if task_config.production_type == "separate_audio":
+            result_keys = ("vocal_path", "instrumental_path", "audio_path")
+        else:
+            result_keys = (
+                "video_path",
+                "subtitles_path",
+                "extra_video_paths",
+                "hls_path",
+            )
+        result = {key: context[key] for key in result_keys if context.get(key)}
+        result["timings_path"] = timings_path
+        if profile_path:
+            result["profile_path"] = profile_path
+        logging.info(f"Result: {result}")
+        return result
+
+    def write_timing_record(self, task_config: Config, manifest, outcome):
+        """Save wall/CPU/RSS/queue timings of the task's last run as JSON."""
+        task_id = self.get_task_id(task_config)
+        stages = manifest.data.get("timings", {})
+        record = {
+            "task_id": task_id,
+            "outcome": outcome,
+            "wall": sum(timing.get("wall", 0) for timing in stages.values()),
+            "cpu": sum(timing.get("cpu", 0) for timing in stages.values()),
+            "queue_wait": sum(
+                timing.get("queue_wait", 0) for timing in stages.values()
+            ),
+            "stages": stages,
+        }
+        timings_path = os.path.join(
+            self.config.output_cache, "timings", f"{task_id}.json"
+        )
+        os.makedirs(os.path.dirname(timings_path), exist_ok=True)
+        with open(timings_path, "w") as f:
+            json.dump(record, f, indent=2)
+        return timings_path
+
+    def build_pipeline(self, task_config: Config):
+        """Stages of the production type with the context keys they read and write."""
+        stages = [
+            Stage(
+                "decode",
+                ["audio_file_name", "audio_file_name_hash"],
+                ["input_audio_path"],
+                self.decode,
+            ),
+            Stage(
+                "separate",
+                ["input_audio_path", "audio_file_name_hash"],
+                ["vocal_audio_path", "instrumental_audio_path"],
+                self.separate,
+            ),
+        ]
+        if task_config.production_type == "separate_audio":
+            stages.append(
+                Stage(
+                    "convert",
+                    ["input_audio_path", "vocal_audio_path", "instrumental_audio_path"],
+                    ["vocal_path", "instrumental_path", "audio_path"],
+                    self.convert,
+                )
+            )
+            return Pipeline(stages)
+
+        stages += [
+            Stage(
+                "align",
+                ["vocal_audio_path", "text_file_name", "text_file_name_hash"],
+                ["alignment_path"],
+                self.align,
+            ),
+            Stage(
+                "subtitle",
+                [
+                    "alignment_path",
+                    "production_type",
+                    "video_resolution",
+                    "extra_resolutions",
+                ],
+                ["subtitles_path", "extra_subtitles"],
+                self.subtitle,
+            ),
+            Stage(
+                "render",
+                [
+                    "subtitles_path",
+                    "extra_subtitles",
+                    "instrumental_audio_path",
+                    "options",
+                    "background_file_name_hash",
+                ],
+                ["video_path", "extra_video_paths", "hls_path"],
+                self.render,
+            ),
+        ]
+        return Pipeline(stages)
+
+    @staticmethod
+    def get_task_id(task_config: Config):
+        if task_config.task_id:
+            return task_config.task_id
+        # Same upload with the same options resumes the same manifest
+        return f"{task_config.audio_file_name}-{task_config.get_options_hash()}"
+
+    @staticmethod
+    def get_input_hashes(task_config: Config, input_cache):
+        """sha256 of each input file of the task, by its file name field."""
+        hashes = {}
+        for field in INPUT_FILE_FIELDS:
+            file_name = getattr(task_config, field)
+            if file_name:
+                file_path = os.path.join(input_cache, file_name)
+                if os.path.exists(file_path):
+                    hashes[field] = hash_file(file_path)
+        return hashes
+
+    @staticmethod
+    def get_job_key(task_config: Config, input_cache):
+        """Hash of the input files' content and the options shaping the output."""
+        options = task_config.to_user_data()
+        del options["task_id"]
+        digest = hashlib.sha256()
+        input_hashes = LyricsVideoGenerator.get_input_hashes(task_config, input_cache)
+        for field, file_hash in input_hashes.items():
+            digest.update(f"{field}={file_hash}\n".encode())
+        for field in INPUT_FILE_FIELDS:
+            del options[field]
+        digest.update(json.dumps(options, sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def get_manifest_path(self, task_id):
+        return os.path.join(self.manifests_path, f"{task_id}.json")
+
+    @staticmethod
+    def list_interrupted_tasks(output_cache):
+        """Return (task id, task data) of tasks stopped in the middle of a stage."""
+        manifests_path = os.path.join(output_cache, "manifests")
+        if not os.path.isdir(manifests_path):
+            return []
+        interrupted = []
+        for file_name in sorted(os.listdir(manifests_path)):
+            if not file_name.endswith(".json"):
+                continue
+            manifest = StageManifest(os.path.join(manifests_path, file_name))
+            task_data = manifest.data["task_data"]
+            # Only tasks with an explicit id belong to a server that can resume them
+            if manifest.status == "running" and task_data.get("task_id"):
+                interrupted.append((task_data["task_id"], task_data))
+        return interrupted
+
+    def decode(self, task_config: Config, inputs):
+        return {"input_audio_path": self.audio_processor.decode_audio(task_config)}
+
+    def separate(self, task_config: Config, inputs):
         (
-            input_audio_path,
-            vocal_audio_full_path,
             instrumental_audio_full_path,
-        ) = self.audio_processor.perform_vocal_separation(task_config)
+            vocal_audio_full_path,
+        ) = self.audio_processor.separate(
+            inputs["input_audio_path"],
+            self.audio_processor.get_source_hash(task_config),
+        )
         if not vocal_audio_full_path:
             logging.error("Vocal separation failed.")
-            return
-        if self.config.production_type == "separate_audio":
-            logging.info("Recoding audios...")
-            vocal_audio_full_path = self.audio_processor.convert_audio(
-                vocal_audio_full_path, vocal_audio_full_path + ".mp3"
-            )
-            instrumental_audio_full_path = self.audio_processor.convert_audio(
-                instrumental_audio_full_path, instrumental_audio_full_path + ".mp3"
-            )
-            input_audio_path = self.audio_processor.convert_audio(
-                input_audio_path, input_audio_path + ".mp3"
-            )
+            return None
+        return {
+            "vocal_audio_path": vocal_audio_full_path,
+            "instrumental_audio_path": instrumental_audio_full_path,
+        }
 
-            result = {
-                "vocal_path": vocal_audio_full_path,
-                "instrumental_path": instrumental_audio_full_path,
-                "audio_path": input_audio_path,
-            }
-            return result
+    def convert(self, task_config: Config, inputs):
+        logging.info("Recoding audios...")
+        outputs = {}
+        for output_key, input_key in (
+            ("vocal_path", "vocal_audio_path"),
+            ("instrumental_path", "instrumental_audio_path"),
+            ("audio_path", "input_audio_path"),
+        ):
+            outputs[output_key] = self.audio_processor.convert_audio(
+                inputs[input_key], inputs[input_key] + ".mp3"
+            )
+        return outputs
 
-        sync_file_path = self.lyrics_aligner.align_lyrics(
-            vocal_audio_full_path, task_config
+    def align(self, task_config: Config, inputs):
+        alignment_path = self.lyrics_aligner.align_words(
+            inputs["vocal_audio_path"], task_config
         )
-        if not sync_file_path:
+        if not alignment_path:
             logging.error("Lyrics alignment failed.")
-            return
-        is_music_production = self.config.production_type == "music"
+            return None
+        return {"alignment_path": alignment_path}
+
+    def subtitle(self, task_config: Config, inputs):
+        alignment_path = inputs["alignment_path"]
+        return {
+            "subtitles_path": self.lyrics_aligner.create_subtitles(
+                alignment_path, task_config
+            ),
+            # One subtitles file per extra resolution, rendered in the same pass
+            "extra_subtitles": [
+                (
+                    resolution,
+                    self.lyrics_aligner.create_subtitles(
+                        alignment_path, task_config, resolution
+                    ),
+                )
+                for resolution in task_config.extra_resolutions
+            ],
+        }
+
+    def render(self, task_config: Config, inputs):
+        is_music_production = task_config.production_type == "music"
+        # The original upload often holds an audio stream the render can copy
+        original_audio_path = os.path.join(
+            self.config.input_cache, task_config.audio_file_name
+        )
         output_file_path = self.video_builder.build_video(
-            sync_file_path,
-            input_audio_path=input_audio_path
+            inputs["subtitles_path"],
+            input_audio_path=original_audio_path
             if is_music_production
-            else instrumental_audio_full_path,
+            else inputs["instrumental_audio_path"],
             task_config=task_config,
+            extra_sync_files=inputs["extra_subtitles"],
         )
+        if not output_file_path:
+            return None
 
-        result = {"video_path": output_file_path, "subtitles_path": sync_file_path}
-
-        if result:
-            logging.info(f"Result: {result}")
-        else:
-            logging.error("Video generation failed.")
-        return result
+        outputs = {"video_path": output_file_path, "extra_video_paths": {}}
+        for width, height in task_config.extra_resolutions:
+            outputs["extra_video_paths"][f"{int(width)}x{int(height)}"] = (
+                self.video_builder.get_output_file_path(task_config, (width, height))
+            )
+        outputs["hls_path"] = None
+        if task_config.hls:
+            hls_path = self.video_builder.get_hls_playlist_path(output_file_path)
+            if os.path.exists(hls_path):
+                outputs["hls_path"] = hls_path
+        return outputs
 
 
 if __name__ == "__main__":
@@ -115,6 +406,10 @@ if __name__ == "__main__":
     )
     args = parser.parse_args()
 
-    config = Config(args)
+    config = Config(args.inputs_cache, args.outputs_cache, args.vocal_separator_model)
+    task_config = Config(
+        args.inputs_cache, args.outputs_cache, args.vocal_separator_model
+    )
+    task_config.from_args(args)
     generator = LyricsVideoGenerator(config)
-    generator.generate()
+    generator.generate(task_config)
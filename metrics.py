@@ -0,0 +1,316 @@
+import resource
+import threading
+import time
+
+# Upper bounds of histogram buckets, seconds and bytes
+DURATION_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+MEMORY_BUCKETS = tuple(2**i * 1024**2 for i in range(7, 16))  # 128 MiB .. 32 GiB
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labelnames, labelvalues, extra=()):
+    pairs = list(zip(labelnames, labelvalues)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{escape_label(v)}"' for k, v in pairs) + "}"
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.values)
+
+    def changes(self, current, previous):
+        return {
+            key: value - previous.get(key, 0)
+            for key, value in current.items()
+            if value != previous.get(key, 0)
+        }
+
+    def merge(self, changes, source):
+        with self.lock:
+            for key, amount in changes.items():
+                self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            return sorted(self.values.items())
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} counter",
+        ]
+        for key, value in self.samples():
+            lines.append(f"{self.name}{format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    """A value that is set; values merged from other processes are summed."""
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.sources = {}  # Process -> its last values
+
+    def set(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self.lock:
+            self.values[key] = value
+
+    def changes(self, current, previous):
+        # Gauges are sent whole, so the receiver can replace the source's values
+        return current if current != previous else {}
+
+    def merge(self, changes, source):
+        with self.lock:
+            self.sources[source] = changes
+
+    def forget(self, source):
+        with self.lock:
+            self.sources.pop(source, None)
+
+    def samples(self):
+        with self.lock:
+            totals = dict(self.values)
+            for values in self.sources.values():
+                for key, value in values.items():
+                    totals[key] = totals.get(key, 0) + value
+        return sorted(totals.items())
+
+    def render(self):
+        lines = super().render()
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DURATION_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets) + (float("inf"),)
+        self.values = {}  # labels -> [bucket counts, sum, count]
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self.lock:
+            counts, total, count = self.values.get(key, ([0] * len(self.buckets), 0, 0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self.values[key] = (counts, total + value, count + 1)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                key: (list(counts), total, count)
+                for key, (counts, total, count) in self.values.items()
+            }
+
+    def changes(self, current, previous):
+        changes = {}
+        for key, (counts, total, count) in current.items():
+            previous_counts, previous_total, previous_count = previous.get(
+                key, ([0] * len(counts), 0, 0)
+            )
+            if count != previous_count:
+                changes[key] = (
+                    [a - b for a, b in zip(counts, previous_counts)],
+                    total - previous_total,
+                    count - previous_count,
+                )
+        return changes
+
+    def merge(self, changes, source):
+        with self.lock:
+            for key, (counts, total, count) in changes.items():
+                own_counts, own_total, own_count = self.values.get(
+                    key, ([0] * len(self.buckets), 0, 0)
+                )
+                self.values[key] = (
+                    [a + b for a, b in zip(own_counts, counts)],
+                    own_total + total,
+                    own_count + count,
+                )
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        with self.lock:
+            for key, (counts, total, count) in sorted(self.values.items()):
+                for bound, bucket_count in zip(self.buckets, counts):
+                    le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                    labels = format_labels(self.labelnames, key, [("le", le)])
+                    lines.append(f"{self.name}_bucket{labels} {bucket_count}")
+                labels = format_labels(self.labelnames, key)
+                lines.append(f"{self.name}_sum{labels} {total}")
+                lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """Process wide metrics rendered in the Prometheus text exposition format.
+
+    Worker processes send what changed in their registry with
+    collect_changes(); the server process adds it to its own with merge().
+    """
+
+    def __init__(self):
+        self.metrics = []
+        self.reported = {}  # Metric name -> snapshot at the last collect_changes
+        self.lock = threading.Lock()
+
+    def counter(self, name, documentation, labelnames=()):
+        metric = Counter(name, documentation, labelnames)
+        self.metrics.append(metric)
+        return metric
+
+    def gauge(self, name, documentation, labelnames=()):
+        metric = Gauge(name, documentation, labelnames)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DURATION_BUCKETS):
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def collect_changes(self):
+        """Changes since the previous call, by metric name."""
+        with self.lock:
+            changes = {}
+            for metric in self.metrics:
+                current = metric.snapshot()
+                previous = self.reported.get(metric.name, {})
+                metric_changes = metric.changes(current, previous)
+                if metric_changes:
+                    changes[metric.name] = metric_changes
+                self.reported[metric.name] = current
+            return changes
+
+    def merge(self, changes, source):
+        """Add the changes collected by another process, named source."""
+        for metric in self.metrics:
+            if metric.name in changes:
+                metric.merge(changes[metric.name], source)
+
+    def forget(self, source):
+        """Drop the gauges of a process that exited."""
+        for metric in self.metrics:
+            if isinstance(metric, Gauge):
+                metric.forget(source)
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+STAGE_WALL_SECONDS = REGISTRY.histogram(
+    "lyri_stage_wall_seconds", "Wall time of pipeline stages", ("stage",)
+)
+STAGE_CPU_SECONDS = REGISTRY.histogram(
+    "lyri_stage_cpu_seconds",
+    "CPU time of pipeline stages, including ffmpeg subprocesses",
+    ("stage",),
+)
+STAGE_PEAK_RSS_BYTES = REGISTRY.histogram(
+    "lyri_stage_peak_rss_bytes",
+    "Peak resident memory of the process at the end of pipeline stages",
+    ("stage",),
+    buckets=MEMORY_BUCKETS,
+)
+STAGE_QUEUE_WAIT_SECONDS = REGISTRY.histogram(
+    "lyri_stage_queue_wait_seconds",
+    "Time tasks waited for a free worker of a stage",
+    ("stage",),
+)
+CACHE_REQUESTS = REGISTRY.counter(
+    "lyri_cache_requests_total",
+    "Cache lookups by cache and result",
+    ("cache", "result"),
+)
+JOBS = REGISTRY.counter("lyri_jobs_total", "Finished tasks by outcome", ("outcome",))
+JOBS_COALESCED = REGISTRY.counter(
+    "lyri_jobs_coalesced_total",
+    "Submissions that joined an identical running task instead of starting one",
+)
+MODEL_RESIDENT = REGISTRY.gauge(
+    "lyri_model_resident", "Whether a model is loaded (1) or evicted (0)", ("model",)
+)
+MODEL_MEMORY_BYTES = REGISTRY.gauge(
+    "lyri_model_memory_bytes", "Approximate memory held by a loaded model", ("model",)
+)
+MODEL_LOAD_SECONDS = REGISTRY.histogram(
+    "lyri_model_load_seconds", "Time to load a model", ("model",)
+)
+MODEL_EVICTIONS = REGISTRY.counter(
+    "lyri_model_evictions_total",
+    "Models unloaded, for being idle or to fit the memory budget",
+    ("model", "reason"),
+)
+
+
+def record_cache(cache, hit):
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+class StageTimer:
+    """Measures wall time, CPU time and peak RSS of a stage on the current thread.
+
+    CPU time adds the calling thread's time to that of finished child
+    processes, which covers ffmpeg; children of concurrent stages can blur it.
+    Peak RSS is the process high-water mark, as reported by getrusage.
+    """
+
+    def __init__(self, stage_name):
+        self.stage_name = stage_name
+        self.timing = {}
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        self.thread_cpu = time.thread_time()
+        self.children_cpu = self.get_children_cpu()
+        return self
+
+    def __exit__(self, *exc_info):
+        wall = time.perf_counter() - self.started
+        cpu = (
+            time.thread_time()
+            - self.thread_cpu
+            + self.get_children_cpu()
+            - self.children_cpu
+        )
+        # ru_maxrss is in KiB on Linux
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        self.timing = {"wall": wall, "cpu": cpu, "peak_rss": peak_rss}
+        STAGE_WALL_SECONDS.observe(wall, stage=self.stage_name)
+        STAGE_CPU_SECONDS.observe(cpu, stage=self.stage_name)
+        STAGE_PEAK_RSS_BYTES.observe(peak_rss, stage=self.stage_name)
+        return False
+
+    def get_children_cpu(self):
+        usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        return usage.ru_utime + usage.ru_stime
@@ -0,0 +1,190 @@
+import gc
+import logging
+import os
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from metrics import (
+    MODEL_EVICTIONS,
+    MODEL_LOAD_SECONDS,
+    MODEL_MEMORY_BYTES,
+    MODEL_RESIDENT,
+)
+
+
+def memory_usage():
+    """Current process RSS plus CUDA memory held by torch, in bytes."""
+    try:
+        with open("/proc/self/statm") as f:
+            rss = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # Peak instead of current RSS, ru_maxrss is in KiB on Linux
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    torch = sys.modules.get("torch")
+    if torch is not None and torch.cuda.is_available():
+        rss += torch.cuda.memory_allocated()
+    return rss
+
+
+def release_memory():
+    gc.collect()
+    torch = sys.modules.get("torch")
+    if torch is not None and torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
+class SharedModel:
+    """A model loaded once and shared read-only by every task.
+
+    Models that keep per-call state must not run concurrently; for those,
+    thread_safe=False makes use() hand the model out under a lock. A model
+    that is not in use may be unloaded by its manager and is loaded again
+    by the next use().
+    """
+
+    def __init__(
+        self, name, loader, thread_safe=True, manager=None, size_estimate=None
+    ):
+        self.name = name
+        self.loader = loader
+        self.thread_safe = thread_safe
+        self.manager = manager
+        self.size = size_estimate or 0
+        self.model = None
+        self.users = 0
+        self.last_used = time.monotonic()
+        self.load_lock = threading.Lock()
+        self.use_lock = threading.Lock()
+
+    @property
+    def is_loaded(self):
+        return self.model is not None
+
+    def get(self):
+        with self.load_lock:
+            return self.load()
+
+    @contextmanager
+    def use(self):
+        with self.load_lock:
+            model = self.load()
+            # Counted as a user, the manager will not evict it meanwhile
+            self.users += 1
+        try:
+            if self.thread_safe:
+                yield model
+            else:
+                with self.use_lock:
+                    yield model
+        finally:
+            with self.load_lock:
+                self.users -= 1
+                self.last_used = time.monotonic()
+
+    def load(self):
+        if self.model is None:
+            if self.manager:
+                self.manager.make_room(self)
+            logging.info(f"Loading model {self.name}")
+            started = time.perf_counter()
+            memory_before = memory_usage()
+            self.model = self.loader()
+            load_time = time.perf_counter() - started
+            # Keep the estimate if the load happened to free as much as it took
+            self.size = max(memory_usage() - memory_before, 0) or self.size
+            logging.info(
+                f"Model {self.name} loaded in {load_time:.1f}s, "
+                f"~{self.size / 1024**2:.0f} MiB"
+            )
+            MODEL_LOAD_SECONDS.observe(load_time, model=self.name)
+            MODEL_MEMORY_BYTES.set(self.size, model=self.name)
+            MODEL_RESIDENT.set(1, model=self.name)
+        self.last_used = time.monotonic()
+        return self.model
+
+    def unload(self, reason):
+        """Drop the model unless it is in use; returns whether it was dropped."""
+        # Never wait here, the caller may hold another model's load lock
+        if not self.load_lock.acquire(blocking=False):
+            return False
+        try:
+            if self.model is None or self.users:
+                return False
+            self.model = None
+        finally:
+            self.load_lock.release()
+        release_memory()
+        logging.info(f"Unloaded model {self.name} ({reason})")
+        MODEL_EVICTIONS.inc(model=self.name, reason=reason)
+        MODEL_RESIDENT.set(0, model=self.name)
+        MODEL_MEMORY_BYTES.set(0, model=self.name)
+        return True
+
+
+class ModelManager:
+    """Keeps shared models within a memory budget and unloads idle ones.
+
+    Sizes are measured as the memory a model added while loading, so they
+    are approximate. Before its first load a model counts with its estimate.
+    """
+
+    def __init__(self, memory_budget_mb=None, idle_ttl=None):
+        self.memory_budget = memory_budget_mb * 1024**2 if memory_budget_mb else None
+        self.idle_ttl = idle_ttl
+        self.models = {}
+        self.lock = threading.Lock()
+        if idle_ttl:
+            threading.Thread(target=self.evict_idle_forever, daemon=True).start()
+
+    def register(self, name, loader, thread_safe=True, size_estimate=None):
+        """Return the holder of a model, creating it on first registration."""
+        with self.lock:
+            if name not in self.models:
+                self.models[name] = SharedModel(
+                    name, loader, thread_safe, self, size_estimate
+                )
+            return self.models[name]
+
+    def preload(self):
+        """Load every registered model now instead of on first use."""
+        with self.lock:
+            models = list(self.models.values())
+        for model in models:
+            model.get()
+
+    def resident_size(self):
+        with self.lock:
+            models = list(self.models.values())
+        return sum(model.size for model in models if model.is_loaded)
+
+    def make_room(self, incoming):
+        """Unload least recently used idle models until incoming fits the budget."""
+        if not self.memory_budget:
+            return
+        with self.lock:
+            loaded = [m for m in self.models.values() if m.is_loaded]
+        for model in sorted(loaded, key=lambda m: m.last_used):
+            if self.resident_size() + incoming.size <= self.memory_budget:
+                return
+            if model is not incoming:
+                model.unload("budget")
+        if self.resident_size() + incoming.size > self.memory_budget:
+            logging.warning(
+                f"Loading {incoming.name} exceeds the model memory budget, "
+                "the other models are in use"
+            )
+
+    def evict_idle(self):
+        now = time.monotonic()
+        with self.lock:
+            models = list(self.models.values())
+        for model in models:
+            if model.is_loaded and now - model.last_used > self.idle_ttl:
+                model.unload("idle")
+
+    def evict_idle_forever(self):
+        while True:
+            time.sleep(max(min(self.idle_ttl / 2, 60), 1))
+            self.evict_idle()
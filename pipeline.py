@@ -0,0 +1,284 @@
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from metrics import STAGE_QUEUE_WAIT_SECONDS, StageTimer, record_cache
+
+
+class Stage:
+    """A pipeline step with declared inputs and outputs.
+
+    run(task_config, inputs) receives the declared inputs from the pipeline
+    context and returns a dict with the declared outputs, or None on failure.
+    Outputs are artifact paths (or lists/dicts of paths) kept on disk.
+    """
+
+    def __init__(self, name, inputs, outputs, run):
+        self.name = name
+        self.inputs = inputs
+        self.outputs = outputs
+        self.run = run
+
+
+class StageManifest:
+    """JSON record of a task's stages, their inputs, artifacts and completion."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.data = {"status": "created", "task_data": {}, "stages": {}}
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                self.data = json.load(f)
+
+    @property
+    def status(self):
+        return self.data["status"]
+
+    def set_status(self, status, task_data=None):
+        with self.lock:
+            self.data["status"] = status
+            if task_data is not None:
+                # A new run starts, its timings replace the previous run's
+                self.data["task_data"] = task_data
+                self.data["timings"] = {}
+            self.save()
+
+    def record_timing(self, stage_name, timing):
+        with self.lock:
+            self.data.setdefault("timings", {})[stage_name] = timing
+            self.save()
+
+    def is_complete(self):
+        """Whether the last run completed and all its artifacts still exist."""
+        return self.status == "completed" and all(
+            artifacts_exist(value) for value in self.outputs().values()
+        )
+
+    def outputs(self):
+        """Artifacts of all completed stages, merged like the pipeline context."""
+        outputs = {}
+        for record in self.data["stages"].values():
+            if record["status"] == "completed":
+                outputs.update(record["outputs"])
+        return outputs
+
+    def completed_outputs(self, stage, inputs):
+        """Outputs of a finished stage if it ran on the same inputs and they exist."""
+        record = self.data["stages"].get(stage.name)
+        if not record or record["status"] != "completed":
+            return None
+        if record["inputs"] != inputs:
+            return None
+        if not all(artifacts_exist(value) for value in record["outputs"].values()):
+            return None
+        return record["outputs"]
+
+    def mark_stage(self, stage, status, inputs=None, outputs=None, elapsed=None):
+        with self.lock:
+            self.data["stages"][stage.name] = {
+                "status": status,
+                "inputs": inputs,
+                "outputs": outputs or {},
+                "elapsed": elapsed,
+                "updated_at": time.time(),
+            }
+            self.save()
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        partial_path = f"{self.path}.{os.getpid()}.partial"
+        with open(partial_path, "w") as f:
+            json.dump(self.data, f, indent=2)
+        os.replace(partial_path, self.path)
+
+
+def artifacts_exist(value):
+    if value is None:
+        return True
+    if isinstance(value, str):
+        return os.path.exists(value)
+    if isinstance(value, dict):
+        return all(artifacts_exist(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return all(artifacts_exist(v) for v in value)
+    return True
+
+
+def normalize(value):
+    """Round-trip through JSON so tuples and lists compare equal to the manifest."""
+    return json.loads(json.dumps(value))
+
+
+class Pipeline:
+    """Runs stages in order, skipping the ones the manifest already completed."""
+
+    def __init__(self, stages):
+        self.stages = stages
+
+    @property
+    def stage_names(self):
+        return [stage.name for stage in self.stages]
+
+    def run(self, task_config, context, manifest, progress_tracker=None):
+        """Run every stage on the context; returns it, or None if a stage failed."""
+        manifest.set_status("running", task_data=task_config.to_user_data())
+        for stage in self.stages:
+            outputs = self.run_stage(
+                stage, task_config, context, manifest, progress_tracker
+            )
+            if outputs is None:
+                return None
+            context.update(outputs)
+        manifest.set_status("completed")
+        return context
+
+    def run_stage(
+        self,
+        stage,
+        task_config,
+        context,
+        manifest,
+        progress_tracker=None,
+        queue_wait=0.0,
+    ):
+        """Run one stage unless the manifest has it; returns its outputs or None."""
+        inputs = normalize({key: context.get(key) for key in stage.inputs})
+        profiler = task_config.profiler
+        # A profiled run measures every stage instead of reusing finished ones
+        outputs = None if profiler else manifest.completed_outputs(stage, inputs)
+        record_cache("stage", outputs is not None)
+        STAGE_QUEUE_WAIT_SECONDS.observe(queue_wait, stage=stage.name)
+        if outputs is not None:
+            logging.info(f"Stage {stage.name} already completed, skipping")
+            manifest.record_timing(
+                stage.name, {"cached": True, "queue_wait": queue_wait}
+            )
+        else:
+            logging.info(f"Stage {stage.name} started")
+            if progress_tracker:
+                progress_tracker.start_stage(stage.name)
+            manifest.mark_stage(stage, "running", inputs)
+            timer = StageTimer(stage.name)
+            try:
+                with timer:
+                    if profiler:
+                        with profiler.profile_stage(stage.name):
+                            outputs = stage.run(task_config, inputs)
+                    else:
+                        outputs = stage.run(task_config, inputs)
+            except Exception:
+                manifest.mark_stage(stage, "failed", inputs)
+                manifest.set_status("failed")
+                raise
+            finally:
+                manifest.record_timing(
+                    stage.name, dict(timer.timing, cached=False, queue_wait=queue_wait)
+                )
+            if outputs is None:
+                logging.error(f"Stage {stage.name} failed")
+                manifest.mark_stage(stage, "failed", inputs)
+                manifest.set_status("failed")
+                return None
+            outputs = normalize(outputs)
+            manifest.mark_stage(
+                stage, "completed", inputs, outputs, timer.timing["wall"]
+            )
+            logging.info(
+                f"Stage {stage.name} finished in {timer.timing['wall']:.1f}s "
+                f"(cpu {timer.timing['cpu']:.1f}s)"
+            )
+        if progress_tracker:
+            progress_tracker.finish_stage(stage.name)
+        return outputs
+
+
+class StageScheduler:
+    """Runs the pipelines of many tasks with a worker pool per stage.
+
+    Every stage has its own concurrency limit, so one task can separate
+    vocals while another aligns and a third renders, instead of each task
+    holding the GPU, CPU and encoder from start to finish.
+    """
+
+    DEFAULT_WORKERS = {
+        "decode": 2,
+        "separate": 1,
+        "convert": 2,
+        "align": 1,
+        "subtitle": 2,
+        "render": 2,
+    }
+
+    def __init__(self, workers=None):
+        self.workers = dict(self.DEFAULT_WORKERS)
+        self.workers.update(workers or {})
+        self.pools = {}
+        self.lock = threading.Lock()
+
+    def get_pool(self, stage_name):
+        with self.lock:
+            if stage_name not in self.pools:
+                self.pools[stage_name] = ThreadPoolExecutor(
+                    max_workers=self.workers.get(stage_name, 1),
+                    thread_name_prefix=f"stage-{stage_name}",
+                )
+            return self.pools[stage_name]
+
+    def submit(self, pipeline, task_config, context, manifest, progress_tracker=None):
+        """Queue a task; the future resolves to its final context or None."""
+        future = Future()
+        manifest.set_status("running", task_data=task_config.to_user_data())
+        self.submit_stage(
+            0, pipeline, task_config, context, manifest, progress_tracker, future
+        )
+        return future
+
+    def submit_stage(
+        self, index, pipeline, task_config, context, manifest, progress_tracker, future
+    ):
+        if index == len(pipeline.stages):
+            manifest.set_status("completed")
+            future.set_result(context)
+            return
+        stage = pipeline.stages[index]
+        submitted = time.perf_counter()
+
+        def run():
+            try:
+                outputs = pipeline.run_stage(
+                    stage,
+                    task_config,
+                    context,
+                    manifest,
+                    progress_tracker,
+                    queue_wait=time.perf_counter() - submitted,
+                )
+            except Exception as e:
+                logging.error(f"Stage {stage.name} raised: {e}")
+                future.set_exception(e)
+                return
+            if outputs is None:
+                future.set_result(None)
+                return
+            context.update(outputs)
+            # Hand the task to the next stage's pool and free this worker
+            self.submit_stage(
+                index + 1,
+                pipeline,
+                task_config,
+                context,
+                manifest,
+                progress_tracker,
+                future,
+            )
+
+        self.get_pool(stage.name).submit(run)
+
+    def shutdown(self, wait=True):
+        with self.lock:
+            pools = list(self.pools.values())
+        for pool in pools:
+            pool.shutdown(wait=wait)
@@ -0,0 +1,111 @@
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import shutil
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+# tracemalloc is process wide, so it runs while any profiled task needs it
+_tracemalloc_users = 0
+_tracemalloc_lock = threading.Lock()
+
+
+def start_tracemalloc():
+    global _tracemalloc_users
+    with _tracemalloc_lock:
+        if _tracemalloc_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        _tracemalloc_users += 1
+
+
+def stop_tracemalloc():
+    global _tracemalloc_users
+    with _tracemalloc_lock:
+        _tracemalloc_users -= 1
+        if _tracemalloc_users == 0:
+            tracemalloc.stop()
+
+
+class TaskProfiler:
+    """Profiles the stages of one task and writes the results as artifacts.
+
+    Stages may run on different scheduler threads, and cProfile only sees
+    the thread it was enabled on, so every stage gets its own profile.
+    They are merged when the report is written.
+    """
+
+    def __init__(self, output_path, top_n=25):
+        self.output_path = output_path
+        self.top_n = top_n
+        self.lock = threading.Lock()
+        self.profiles = []
+        self.stages = {}
+        self.ffmpeg_benchmarks = []
+
+    @contextmanager
+    def profile_stage(self, stage_name):
+        profile = cProfile.Profile()
+        start_tracemalloc()
+        tracemalloc.reset_peak()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            _, peak = tracemalloc.get_traced_memory()
+            snapshot = tracemalloc.take_snapshot()
+            stop_tracemalloc()
+            top_allocations = [
+                {
+                    "location": str(stat.traceback),
+                    "size": stat.size,
+                    "count": stat.count,
+                }
+                for stat in snapshot.statistics("lineno")[: self.top_n]
+            ]
+            with self.lock:
+                self.profiles.append(profile)
+                self.stages[stage_name] = {
+                    "traced_peak": peak,
+                    "top_allocations": top_allocations,
+                }
+
+    def record_ffmpeg_benchmark(self, stderr):
+        """Keep the "bench:" lines ffmpeg prints when run with -benchmark."""
+        lines = [
+            line.strip()
+            for line in stderr.decode("utf-8", "ignore").splitlines()
+            if line.startswith("bench:")
+        ]
+        with self.lock:
+            self.ffmpeg_benchmarks.append(lines)
+
+    def write(self, timings=None):
+        """Write profile.prof, profile.txt and profile.json; returns their zip."""
+        os.makedirs(self.output_path, exist_ok=True)
+        with self.lock:
+            profiles = list(self.profiles)
+            report = {
+                "timings": timings or {},
+                "stages": dict(self.stages),
+                "ffmpeg_benchmarks": list(self.ffmpeg_benchmarks),
+            }
+        if profiles:
+            stats = pstats.Stats(profiles[0])
+            for profile in profiles[1:]:
+                stats.add(profile)
+            stats.dump_stats(os.path.join(self.output_path, "profile.prof"))
+            text = io.StringIO()
+            stats.stream = text
+            stats.sort_stats("cumulative").print_stats(self.top_n * 2)
+            with open(os.path.join(self.output_path, "profile.txt"), "w") as f:
+                f.write(text.getvalue())
+        with open(os.path.join(self.output_path, "profile.json"), "w") as f:
+            json.dump(report, f, indent=2)
+        archive_path = shutil.make_archive(self.output_path, "zip", self.output_path)
+        logging.info(f"Profile written to {archive_path}")
+        return archive_path
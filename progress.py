@@ -0,0 +1,121 @@
+import threading
+import time
+
+
+class ProgressTracker:
+    """Combines per-stage progress into a single task fraction and ETA."""
+
+    # Relative cost of each pipeline stage, used to weight the overall fraction
+    STAGE_WEIGHTS = {
+        "decode": 0.05,
+        "separate": 0.3,
+        "convert": 0.1,
+        "align": 0.25,
+        "subtitle": 0.02,
+        "render": 0.4,
+    }
+
+    STAGE_TITLES = {
+        "decode": "Decoding audio",
+        "separate": "Separating vocals",
+        "convert": "Recoding audio",
+        "align": "Aligning lyrics",
+        "subtitle": "Laying out subtitles",
+        "render": "Rendering video",
+    }
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+        self.weights = dict(self.STAGE_WEIGHTS)
+        self.stage_progress = {}
+        self.stage = None
+        self.details = {}
+        self.artifacts = {}
+
+    def plan(self, stages):
+        """Restrict the weighting to the stages this task will actually run."""
+        with self.lock:
+            weights = {s: self.STAGE_WEIGHTS.get(s, 0.1) for s in stages}
+            total = sum(weights.values()) or 1
+            self.weights = {s: w / total for s, w in weights.items()}
+        self._notify()
+
+    def start_stage(self, stage):
+        self.update(stage, 0.0)
+
+    def finish_stage(self, stage):
+        self.update(stage, 1.0)
+
+    def update(self, stage, fraction, **details):
+        """Record progress (0..1) of a stage with optional stage details."""
+        with self.lock:
+            if stage != self.stage:
+                self.details = {}
+            self.stage = stage
+            self.stage_progress[stage] = min(max(float(fraction), 0.0), 1.0)
+            self.details.update(details)
+        self._notify()
+
+    def publish_artifact(self, key, path):
+        """Expose an artifact that can be served before the task completes."""
+        with self.lock:
+            self.artifacts[key] = path
+        self._notify()
+
+    @property
+    def fraction(self):
+        with self.lock:
+            return self._fraction()
+
+    def _fraction(self):
+        total = sum(self.weights.values()) or 1
+        done = sum(
+            weight * self.stage_progress.get(stage, 0.0)
+            for stage, weight in self.weights.items()
+        )
+        return min(done / total, 1.0)
+
+    def eta(self):
+        """Estimated seconds until completion, or None while unknown."""
+        with self.lock:
+            fraction = self._fraction()
+        if fraction <= 0:
+            return None
+        elapsed = time.time() - self.started_at
+        return max(elapsed * (1 - fraction) / fraction, 0.0)
+
+    def snapshot(self):
+        with self.lock:
+            fraction = self._fraction()
+            snapshot = {
+                "stage": self.stage,
+                "progress": round(fraction, 4),
+                "elapsed": round(time.time() - self.started_at, 1),
+                "details": dict(self.details),
+                "artifacts": dict(self.artifacts),
+            }
+        eta = self.eta()
+        snapshot["eta"] = round(eta, 1) if eta is not None else None
+        return snapshot
+
+    def _notify(self):
+        if self.callback:
+            self.callback(self.snapshot())
+
+
+def format_progress(snapshot):
+    """Render a progress snapshot as a short human readable status line."""
+    if not snapshot or not snapshot.get("stage"):
+        return "Doing magic now, please wait..."
+    title = ProgressTracker.STAGE_TITLES.get(snapshot["stage"], snapshot["stage"])
+    text = f"{title}... {int(snapshot.get('progress', 0) * 100)}%"
+    details = snapshot.get("details") or {}
+    if details.get("speed"):
+        text += f" ({details['speed']}x)"
+    eta = snapshot.get("eta")
+    if eta is not None:
+        minutes, seconds = divmod(int(eta), 60)
+        text += f"\nETA: {minutes}m {seconds:02d}s"
+    return text
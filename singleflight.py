@@ -0,0 +1,70 @@
+import logging
+import threading
+from metrics import JOBS_COALESCED
+
+
+class Flight:
+    """A running job and the progress callbacks of everyone waiting for it."""
+
+    def __init__(self):
+        self.future = None
+        self.callbacks = []
+        self.snapshot = None
+        self.lock = threading.Lock()
+
+    def subscribe(self, callback):
+        with self.lock:
+            self.callbacks.append(callback)
+            snapshot = self.snapshot
+        # Late joiners start from the latest progress instead of from zero
+        if snapshot is not None:
+            callback(snapshot)
+
+    def publish(self, snapshot):
+        with self.lock:
+            self.snapshot = snapshot
+            callbacks = list(self.callbacks)
+        for callback in callbacks:
+            callback(snapshot)
+
+
+class SingleFlight:
+    """Coalesces identical jobs, a second submission waits for the first one.
+
+    Jobs are identified by a key, typically the hash of their inputs and
+    options. Once the job finishes its key is forgotten, later submissions
+    start a new job (which mostly hits the stage caches).
+    """
+
+    def __init__(self):
+        self.flights = {}
+        self.lock = threading.Lock()
+
+    def submit(self, key, start, progress_callback=None):
+        """Return (future, joined) of the job for key.
+
+        When no identical job is running, start(publish) must launch one and
+        return its future; publish fans its progress out to every submitter.
+        """
+        with self.lock:
+            flight = self.flights.get(key)
+            joined = flight is not None
+            if not joined:
+                flight = Flight()
+                if progress_callback:
+                    flight.subscribe(progress_callback)
+                flight.future = start(flight.publish)
+                self.flights[key] = flight
+        if joined:
+            logging.info(f"Joined the running job {key[:12]}")
+            JOBS_COALESCED.inc()
+            if progress_callback:
+                flight.subscribe(progress_callback)
+        else:
+            flight.future.add_done_callback(lambda _: self.forget(key, flight))
+        return flight.future, joined
+
+    def forget(self, key, flight):
+        with self.lock:
+            if self.flights.get(key) is flight:
+                del self.flights[key]
@@ -8,35 +8,35 @@ class AdvancedSRTtoASSConverter:
         self.config = config
         self.word_threshold = 0.1  # Time (s) below which words will merge
 
-    def _generate_ass_header(self):
+    def _generate_ass_header(self, resolution):
         """Generates ASS header with video resolution for proper scaling."""
         return f"""[Script Info]
     ; Script generated by Liri.ai - your music-friendly bot
     Title: Word-Level Animated Subtitles
     ScriptType: v4.00+
     Collisions: Normal
-    PlayResX: {self.config.video_resolution[0]}  ;
-    PlayResY: {self.config.video_resolution[1]} ;
+    PlayResX: {resolution[0]}  ;
+    PlayResY: {resolution[1]} ;
     PlayDepth: 0
 
     [V4+ Styles]
     Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, Bold, Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, Alignment, MarginL, MarginR, MarginV, Encoding
-    Style: Default,Default,{self._calculate_font_size()},&H00FFFFFF,&H0000FFFF,&H00000000,&H64000000,-1,0,0,0,100,100,0,0,1,4,1,5,20,20,40,1
+    Style: Default,Default,{self._calculate_font_size(resolution)},&H00FFFFFF,&H0000FFFF,&H00000000,&H64000000,-1,0,0,0,100,100,0,0,1,4,1,5,20,20,40,1
 
     [Events]
     Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
     """
 
-    def convert(self, subs, ass_file_name, task_config: Config):
+    def convert(self, subs, ass_file_name, task_config: Config, resolution=None):
         """Convert SRT with word-level timestamps to animated ASS subtitle."""
-        frame_width, frame_height = task_config.video_resolution
-        frame_width, frame_height = (int(frame_width), int(frame_height))
+        resolution = resolution or task_config.video_resolution
+        frame_width, frame_height = (int(resolution[0]), int(resolution[1]))
 
         subs = self._group_fast_words(subs)
-        font_size = self._calculate_font_size()
+        font_size = self._calculate_font_size(resolution)
 
         with open(ass_file_name, "w", encoding="utf-8") as file:
-            file.write(self._generate_ass_header())
+            file.write(self._generate_ass_header(resolution))
 
             for i, sub in enumerate(subs):
                 time_start = sub["start"]
@@ -114,9 +114,9 @@ class AdvancedSRTtoASSConverter:
         ms = int((seconds - int(seconds)) * 100)
         return f"{h:01d}:{m:02d}:{s:02d}.{ms:02d}"
 
-    def _calculate_font_size(self):
+    def _calculate_font_size(self, resolution):
         """Calculates a dynamic font size based on video resolution."""
-        frame_width, frame_height = self.config.video_resolution
+        frame_width, frame_height = map(int, resolution)
 
         # Define a base font size for a standard resolution (e.g., 1080p)
         base_font_size = 40
@@ -0,0 +1,50 @@
+import asyncio
+import threading
+
+
+class TaskEvents:
+    """Wakes up requests waiting for a task to change.
+
+    Every change of a task bumps its version. Waiters pass the version they
+    have seen, so a change that lands between reading a task and starting
+    to wait is not missed. notify() may be called from any thread. The
+    version of a deleted task is dropped once its waiters are woken.
+    """
+
+    def __init__(self):
+        self.versions = {}
+        self.waiters = {}
+        self.lock = threading.Lock()
+
+    def version(self, task_id):
+        with self.lock:
+            return self.versions.get(task_id, 0)
+
+    def notify(self, task_id, deleted=False):
+        with self.lock:
+            if deleted:
+                self.versions.pop(task_id, None)
+            else:
+                self.versions[task_id] = self.versions.get(task_id, 0) + 1
+            waiters = list(self.waiters.get(task_id, ()))
+        for loop, event in waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    async def wait(self, task_id, version, timeout):
+        """Wait until the task is past version; returns False on timeout."""
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self.lock:
+            if self.versions.get(task_id, 0) != version:
+                return True
+            self.waiters.setdefault(task_id, set()).add(waiter)
+        try:
+            await asyncio.wait_for(waiter[1].wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            with self.lock:
+                waiters = self.waiters.get(task_id)
+                waiters.discard(waiter)
+                if not waiters:
+                    del self.waiters[task_id]
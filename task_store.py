@@ -0,0 +1,229 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    task_id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    error TEXT,
+    input_files TEXT NOT NULL DEFAULT '{}',
+    input_hashes TEXT NOT NULL DEFAULT '{}',
+    results TEXT NOT NULL DEFAULT '{}',
+    progress TEXT NOT NULL DEFAULT '{}'
+);
+CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, created_at);
+CREATE INDEX IF NOT EXISTS tasks_created_at ON tasks (created_at);
+"""
+
+JSON_FIELDS = ("input_files", "input_hashes", "results", "progress")
+COLUMNS = (
+    "task_id",
+    "status",
+    "created_at",
+    "updated_at",
+    "started_at",
+    "finished_at",
+    "error",
+) + JSON_FIELDS
+
+# Tasks in these states are never expired
+ACTIVE_STATUSES = ("Processing",)
+
+
+class TaskStore:
+    """Server tasks in SQLite, shared by threads and worker processes.
+
+    WAL mode lets readers poll statuses while a worker writes. Every thread
+    and process opens its own connection; writes that read a record first
+    run in an IMMEDIATE transaction, so concurrent updates do not get lost.
+    """
+
+    def __init__(self, path, ttl=None, on_change=None):
+        self.path = path
+        self.ttl = ttl
+        # Called with the task id and whether it was deleted, after every
+        # committed change of a task
+        self.on_change = on_change
+        self.local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        db = self.connect()
+        db.executescript(SCHEMA)
+        self.migrate(db)
+        if ttl:
+            threading.Thread(target=self.expire_forever, daemon=True).start()
+
+    def connect(self):
+        # Connections must not cross a fork, a forked worker opens its own
+        if getattr(self.local, "pid", None) != os.getpid():
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.row_factory = sqlite3.Row
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self.local.db = db
+            self.local.pid = os.getpid()
+        return self.local.db
+
+    def changed(self, task_id, deleted=False):
+        if self.on_change:
+            self.on_change(task_id, deleted)
+
+    @staticmethod
+    def migrate(db):
+        """Add the columns newer than an existing database."""
+        columns = {row["name"] for row in db.execute("PRAGMA table_info(tasks)")}
+        if "input_hashes" not in columns:
+            db.execute(
+                "ALTER TABLE tasks ADD COLUMN input_hashes TEXT NOT NULL DEFAULT '{}'"
+            )
+
+    @contextmanager
+    def transaction(self):
+        db = self.connect()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    @staticmethod
+    def to_task(row):
+        if row is None:
+            return None
+        task = dict(row)
+        for field in JSON_FIELDS:
+            if field in task:
+                task[field] = json.loads(task[field])
+        return task
+
+    def create(self, task_id, status="Uploaded"):
+        """Add a task; returns False if the id is taken."""
+        now = time.time()
+        cursor = self.connect().execute(
+            "INSERT OR IGNORE INTO tasks (task_id, status, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?)",
+            (task_id, status, now, now),
+        )
+        if cursor.rowcount == 1:
+            self.changed(task_id)
+        return cursor.rowcount == 1
+
+    def get(self, task_id):
+        row = (
+            self.connect()
+            .execute("SELECT * FROM tasks WHERE task_id = ?", (task_id,))
+            .fetchone()
+        )
+        return self.to_task(row)
+
+    def update(self, task_id, **fields):
+        """Overwrite fields of a task; JSON fields are replaced as a whole."""
+        unknown = set(fields) - set(COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown task fields: {', '.join(sorted(unknown))}")
+        fields["updated_at"] = time.time()
+        values = [
+            json.dumps(value) if field in JSON_FIELDS else value
+            for field, value in fields.items()
+        ]
+        assignments = ", ".join(f"{field} = ?" for field in fields)
+        db = self.connect()
+        cursor = db.execute(
+            f"UPDATE tasks SET {assignments} WHERE task_id = ?", (*values, task_id)
+        )
+        # Inside a transaction, the caller notifies once it is committed
+        if cursor.rowcount == 1 and not db.in_transaction:
+            self.changed(task_id)
+        return cursor.rowcount == 1
+
+    def merge(self, task_id, field, values):
+        """Add keys to a JSON field of a task without dropping the others."""
+        with self.transaction() as db:
+            row = db.execute(
+                f"SELECT {field} FROM tasks WHERE task_id = ?", (task_id,)
+            ).fetchone()
+            if row is None:
+                return False
+            merged = {**json.loads(row[field]), **values}
+            db.execute(
+                f"UPDATE tasks SET {field} = ?, updated_at = ? WHERE task_id = ?",
+                (json.dumps(merged), time.time(), task_id),
+            )
+        self.changed(task_id)
+        return True
+
+    def transition(self, task_id, from_statuses, status, **fields):
+        """Set the status only if it is one of from_statuses; returns success."""
+        with self.transaction() as db:
+            row = db.execute(
+                "SELECT status FROM tasks WHERE task_id = ?", (task_id,)
+            ).fetchone()
+            if row is None or row["status"] not in from_statuses:
+                return False
+            self.update(task_id, status=status, **fields)
+        self.changed(task_id)
+        return True
+
+    def list(self, status=None, created_after=None, limit=50, offset=0):
+        """Newest tasks first, without their progress; returns (tasks, total)."""
+        conditions = []
+        parameters = []
+        if status:
+            conditions.append("status = ?")
+            parameters.append(status)
+        if created_after is not None:
+            conditions.append("created_at > ?")
+            parameters.append(created_after)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        db = self.connect()
+        total = db.execute(f"SELECT COUNT(*) FROM tasks {where}", parameters)
+        total = total.fetchone()[0]
+        columns = ", ".join(column for column in COLUMNS if column != "progress")
+        rows = db.execute(
+            f"SELECT {columns} FROM tasks {where} "
+            "ORDER BY created_at DESC LIMIT ? OFFSET ?",
+            (*parameters, limit, offset),
+        ).fetchall()
+        return [self.to_task(row) for row in rows], total
+
+    def delete(self, task_id):
+        cursor = self.connect().execute(
+            "DELETE FROM tasks WHERE task_id = ?", (task_id,)
+        )
+        if cursor.rowcount == 1:
+            self.changed(task_id, deleted=True)
+        return cursor.rowcount == 1
+
+    def expire(self):
+        """Delete tasks untouched for longer than the TTL, except running ones."""
+        placeholders = ", ".join("?" for _ in ACTIVE_STATUSES)
+        condition = f"updated_at < ? AND status NOT IN ({placeholders})"
+        parameters = (time.time() - self.ttl, *ACTIVE_STATUSES)
+        with self.transaction() as db:
+            rows = db.execute(
+                f"SELECT task_id FROM tasks WHERE {condition}", parameters
+            ).fetchall()
+            db.execute(f"DELETE FROM tasks WHERE {condition}", parameters)
+        for row in rows:
+            self.changed(row["task_id"], deleted=True)
+        if rows:
+            logging.info(f"Expired {len(rows)} tasks")
+        return len(rows)
+
+    def expire_forever(self):
+        while True:
+            time.sleep(max(min(self.ttl / 2, 3600), 1))
+            try:
+                self.expire()
+            except sqlite3.Error as e:
+                logging.error(f"Could not expire tasks: {e}")
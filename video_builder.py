@@ -1,13 +1,39 @@
 import os
+import re
 import ffmpeg
 import logging
+import threading
 from config import Config
+from hashing import hash_file
+from watermark import WatermarkRenderer
+from metrics import record_cache
 
 
 class VideoBuilder:
+    # Length (s) of the excerpt rendered when no preview range is requested
+    PREVIEW_DURATION = 20
+    IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tiff")
+    # Background codecs that can be stream-copied into mp4 and mkv outputs
+    COPYABLE_VIDEO_CODECS = ("h264", "hevc")
+    OUTPUT_CONTAINERS = ("mp4", "mkv")
+    # Audio codecs that can be stream-copied into mp4, mkv accepts any codec
+    MP4_AUDIO_CODECS = ("aac", "mp3")
+    # "faststart" moves the moov atom to the front once the encode finishes,
+    # "fragmented" writes CMAF-style fragments that play while being written
+    MP4_MOVFLAGS = {
+        "faststart": "+faststart",
+        "fragmented": "+frag_keyframe+empty_moov+default_base_moof",
+    }
+
     def __init__(self, config):
         self.config = config
         self.default_background_path = self.config.default_background_path
+        self.background_cache_path = os.path.join(
+            self.config.input_cache, "background_cache"
+        )
+        self.audio_cache_path = os.path.join(self.config.input_cache, "audio_cache")
+        self.audio_cache_lock = threading.Lock()
+        self.watermark_renderer = WatermarkRenderer(config)
 
     def get_audio_duration(self, audio_path):
         """Get the duration of the audio."""
@@ -54,86 +80,641 @@ class VideoBuilder:
             logging.error(f"Error stripping audio from video: {e.stderr.decode()}")
             return None
 
-    def build_video(self, sync_file_path, input_audio_path, task_config: Config):
-        """Build the final video with the desired size and embed it."""
-        output_file_path = os.path.join(
-            self.config.output_cache, f"{task_config.audio_file_name}_aligned.mp4"
-        )
-        background_path = (
-            os.path.join(self.config.input_cache, task_config.background_file_name)
-            if task_config.background_file_name
-            else self.default_background_path
+    def get_container(self, task_config: Config):
+        container = task_config.output_container
+        if container not in self.OUTPUT_CONTAINERS:
+            logging.warning(f"Unsupported container {container}, using mp4")
+            container = "mp4"
+        return container
+
+    def get_output_file_path(self, task_config: Config, resolution=None):
+        """Path of a render, extra resolutions get their size in the name."""
+        suffix = "preview" if task_config.preview else "aligned"
+        if resolution:
+            suffix += f"_{int(resolution[0])}x{int(resolution[1])}"
+        return os.path.join(
+            self.config.output_cache,
+            f"{task_config.get_output_name()}_{suffix}.{self.get_container(task_config)}",
         )
 
+    def get_background_path(self, task_config: Config):
+        if task_config.background_file_name:
+            return os.path.join(
+                self.config.input_cache, task_config.background_file_name
+            )
+        return self.default_background_path
+
+    def get_render_window(self, sync_file_path, duration, task_config: Config):
+        """Return start, duration, scale and x264 preset of the render."""
+        if not task_config.preview:
+            return 0, duration, 1, "fast"
+        start, end = self.get_preview_range(sync_file_path, duration, task_config)
+        return start, end - start, task_config.preview_scale, "ultrafast"
+
+    def build_video(
+        self,
+        sync_file_path,
+        input_audio_path,
+        task_config: Config,
+        extra_sync_files=None,
+    ):
+        """Build the final video with the desired size and embed it.
+
+        extra_sync_files lists (resolution, subtitles path) pairs rendered in
+        the same ffmpeg pass, see build_multi_resolution_video.
+        """
+        if extra_sync_files:
+            return self.build_multi_resolution_video(
+                [(task_config.video_resolution, sync_file_path)] + extra_sync_files,
+                input_audio_path,
+                task_config,
+            )
+
+        container = self.get_container(task_config)
+        output_file_path = self.get_output_file_path(task_config)
+        background_path = self.get_background_path(task_config)
+
         frame_rate = self.get_video_frame_rate(background_path)
         duration = self.get_audio_duration(input_audio_path)
+        start, duration, scale, preset = self.get_render_window(
+            sync_file_path, duration, task_config
+        )
+        # Desired final size
+        width, height = self.scale_resolution(task_config.video_resolution, scale)
 
         try:
-            width, height = task_config.video_resolution  # Desired final size
             print(f"Building video with resolution: {width}x{height}")
 
+            # Soft subtitles leave a background that already fits untouched
+            soft_subtitles = task_config.subtitles_mode == "soft"
+            copy_video = soft_subtitles and self.can_copy_video(
+                background_path, width, height
+            )
+
+            # Reuse the background pre-scaled to this resolution when possible.
+            # Previews only pick up the full size one a full render prepared,
+            # and scale it down further
+            normalized_path = None
+            if not copy_video and task_config.preview:
+                normalized_path = self.normalize_background(
+                    background_path,
+                    *self.scale_resolution(task_config.video_resolution, 1),
+                    frame_rate,
+                    create=False,
+                )
+            elif not copy_video:
+                normalized_path = self.normalize_background(
+                    background_path, width, height, frame_rate
+                )
+            if normalized_path:
+                background_path = normalized_path
+                copy_video = (
+                    soft_subtitles
+                    and not task_config.preview
+                    and not self.is_image(normalized_path)
+                )
+
             # Process background input (image or video)
-            inv = self.prepare_background(background_path, frame_rate, duration)
+            inv = self.prepare_background(
+                background_path,
+                frame_rate,
+                duration,
+                start,
+                has_audio=not (normalized_path or copy_video),
+            )
 
-            # Input audio
-            ina = ffmpeg.input(input_audio_path)
+            # Input audio, copied as is or from a cached AAC encode
+            audio_path, acodec = self.prepare_audio(input_audio_path, container)
+            ina = (
+                ffmpeg.input(audio_path, ss=start)
+                if start
+                else ffmpeg.input(audio_path)
+            )
 
             # Scale & pad video to fit inside the final resolution
-            vf_filters = self.create_video_filters(width, height, sync_file_path)
-
-            # Add subtitles and overlay text if necessary
-            if sync_file_path:
-                vf_filters += f",subtitles={sync_file_path}"
-            if self.config.overlay_text:
-                vf_filters += (
-                    f",drawtext=text='{self.config.overlay_text}':"
-                    "x=5:y=5:fontcolor=white:fontsize='sqrt(w*h)*0.05'"
+            video = inv.video
+            if not copy_video and (not normalized_path or task_config.preview):
+                video = self.scale_and_pad(video, width, height)
+
+            output_args = self.get_container_args(task_config.mp4_mode, container)
+            if soft_subtitles:
+                out = self.create_soft_subtitles_output(
+                    video,
+                    ina,
+                    sync_file_path,
+                    output_file_path,
+                    acodec=acodec,
+                    copy_video=copy_video,
+                    container=container,
+                    start=start,
+                    duration=duration,
+                    preset=preset,
+                    output_args=output_args,
+                )
+            else:
+                # Add subtitles and overlay text if necessary
+                video = self.burn_overlays(video, sync_file_path, width, height, start)
+
+                # Explicitly set pixel format and color range
+                encode_args = dict(
+                    preset=preset,
+                    pix_fmt="yuv420p",  # Explicit pixel format
+                    acodec=acodec,
+                    strict="experimental",
+                    shortest=None,
+                    t=duration,
+                    color_range="tv",  # Optionally set color range ("tv" or "pc")
                 )
+                if self.should_package_hls(task_config, container):
+                    out = self.create_hls_output(
+                        video,
+                        ina,
+                        output_file_path,
+                        width=width,
+                        height=height,
+                        frame_rate=frame_rate,
+                        task_config=task_config,
+                        encode_args=encode_args,
+                        output_args=output_args,
+                    )
+                else:
+                    out = ffmpeg.output(
+                        video, ina.audio, output_file_path, **encode_args, **output_args
+                    ).overwrite_output()
 
-            # Explicitly set pixel format and color range
-            out = ffmpeg.output(
-                inv,
-                ina,
-                output_file_path,
-                vf=vf_filters,
-                preset="fast",
-                pix_fmt="yuv420p",  # Explicit pixel format
-                acodec="aac",
-                strict="experimental",
-                shortest=None,
-                t=duration,
-                color_range="tv",  # Optionally set color range (e.g., "tv" or "pc")
-            ).overwrite_output()
-
-            out.run()
+            # Fragmented MP4 is playable while written, so it can be served early
+            if "frag_keyframe" in output_args.get("movflags", ""):
+                if os.path.exists(output_file_path):
+                    os.remove(output_file_path)
+                if task_config.progress_tracker:
+                    task_config.progress_tracker.publish_artifact(
+                        "video_file_path", output_file_path
+                    )
+
+            self.run_with_progress(
+                out, duration, task_config.progress_tracker, task_config.profiler
+            )
             logging.info(f"Video created successfully: {output_file_path}")
             return output_file_path
         except ffmpeg.Error as e:
             logging.error(f"Error occurred during video creation: {e.stderr.decode()}")
             return None
 
-    def prepare_background(self, background_path, frame_rate, duration):
-        """Prepare background video or image for video creation."""
-        is_image = background_path.lower().endswith(
-            (".png", ".jpg", ".jpeg", ".bmp", ".tiff")
+    def build_multi_resolution_video(self, sync_files, input_audio_path, task_config):
+        """Render several resolutions from one decode of the shared inputs.
+
+        sync_files holds (resolution, subtitles path) pairs, the first one is
+        the task's main resolution. The background is decoded once and split
+        per resolution; each branch gets its own scaling and subtitles. Extra
+        renders are written to get_output_file_path(task_config, resolution).
+        Soft subtitles, mezzanines and HLS only apply to single renders.
+        """
+        container = self.get_container(task_config)
+        background_path = self.get_background_path(task_config)
+        frame_rate = self.get_video_frame_rate(background_path)
+        duration = self.get_audio_duration(input_audio_path)
+        start, duration, scale, preset = self.get_render_window(
+            sync_files[0][1], duration, task_config
         )
-        if is_image:
+
+        try:
+            inv = self.prepare_background(background_path, frame_rate, duration, start)
+            audio_path, acodec = self.prepare_audio(input_audio_path, container)
+            ina = (
+                ffmpeg.input(audio_path, ss=start)
+                if start
+                else ffmpeg.input(audio_path)
+            )
+            output_args = self.get_container_args(task_config.mp4_mode, container)
+
+            split = inv.video.filter_multi_output("split", len(sync_files))
+            outputs = []
+            output_paths = []
+            for i, (resolution, sync_file_path) in enumerate(sync_files):
+                width, height = self.scale_resolution(resolution, scale)
+                print(f"Building video with resolution: {width}x{height}")
+                video = self.scale_and_pad(split[i], width, height)
+                video = self.burn_overlays(video, sync_file_path, width, height, start)
+                output_file_path = self.get_output_file_path(
+                    task_config, resolution if i else None
+                )
+                outputs.append(
+                    ffmpeg.output(
+                        video,
+                        ina.audio,
+                        output_file_path,
+                        preset=preset,
+                        pix_fmt="yuv420p",
+                        acodec=acodec,
+                        strict="experimental",
+                        shortest=None,
+                        t=duration,
+                        color_range="tv",
+                        **output_args,
+                    )
+                )
+                output_paths.append(output_file_path)
+
+            out = ffmpeg.merge_outputs(*outputs).overwrite_output()
+            self.run_with_progress(
+                out, duration, task_config.progress_tracker, task_config.profiler
+            )
+            logging.info(f"Videos created successfully: {output_paths}")
+            return output_paths[0]
+        except ffmpeg.Error as e:
+            logging.error(f"Error occurred during video creation: {e.stderr.decode()}")
+            return None
+
+    def run_with_progress(self, out, duration, progress_tracker=None, profiler=None):
+        """Run ffmpeg while parsing its -progress stream into the tracker."""
+        out = out.global_args("-progress", "pipe:1", "-nostats")
+        if profiler:
+            out = out.global_args("-benchmark")
+        process = out.run_async(pipe_stdout=True, pipe_stderr=True)
+
+        # Drain stderr in the background so ffmpeg never blocks on a full pipe
+        stderr_chunks = []
+        stderr_reader = threading.Thread(
+            target=lambda: stderr_chunks.extend(iter(process.stderr.readline, b"")),
+            daemon=True,
+        )
+        stderr_reader.start()
+
+        stats = {}
+        for raw_line in iter(process.stdout.readline, b""):
+            key, _, value = raw_line.decode("utf-8", "ignore").strip().partition("=")
+            stats[key] = value
+            if key != "progress":
+                continue
+            # A "progress" line closes each block of key=value pairs
+            encoded = self.parse_progress_time(stats)
+            if progress_tracker and duration:
+                progress_tracker.update(
+                    "render",
+                    encoded / duration,
+                    time_encoded=round(encoded, 2),
+                    fps=stats.get("fps"),
+                    speed=stats.get("speed", "").rstrip("x") or None,
+                )
+            if value == "end":
+                break
+
+        process.wait()
+        stderr_reader.join()
+        stderr = b"".join(stderr_chunks)
+        if profiler:
+            profiler.record_ffmpeg_benchmark(stderr)
+        if process.returncode != 0:
+            raise ffmpeg.Error("ffmpeg", None, stderr)
+        if progress_tracker:
+            progress_tracker.finish_stage("render")
+
+    def parse_progress_time(self, stats):
+        """Seconds of output encoded so far from an ffmpeg -progress block."""
+        for key in ("out_time_us", "out_time_ms"):
+            # Both keys are reported in microseconds by ffmpeg
+            value = stats.get(key, "N/A")
+            if value.lstrip("-").isdigit():
+                return max(int(value), 0) / 1_000_000
+        return 0.0
+
+    def get_preview_range(self, sync_file_path, duration, task_config: Config):
+        """Pick the excerpt to preview: the requested range or the first lyrics."""
+        if task_config.preview_range:
+            start, end = map(float, task_config.preview_range)
+        else:
+            start = max(self.get_first_subtitle_time(sync_file_path) - 1, 0)
+            end = start + self.PREVIEW_DURATION
+        if duration:
+            end = min(end, duration)
+            start = min(start, max(end - 1, 0))
+        return start, end
+
+    def get_first_subtitle_time(self, sync_file_path):
+        """Start time (s) of the first cue in an ASS or SRT subtitles file."""
+        if not sync_file_path or not os.path.exists(sync_file_path):
+            return 0
+        cue = re.compile(r"(?:Dialogue: \d+,|^)(\d+):(\d+):(\d+)[.,](\d+)")
+        with open(sync_file_path, "r", encoding="utf-8") as f:
+            for line in f:
+                match = cue.search(line.strip())
+                if match:
+                    h, m, s, fraction = match.groups()
+                    return (
+                        int(h) * 3600
+                        + int(m) * 60
+                        + int(s)
+                        + int(fraction) / 10 ** len(fraction)
+                    )
+        return 0
+
+    def scale_resolution(self, resolution, scale):
+        """Scale a (width, height) pair, keeping both sides even for yuv420p."""
+        width, height = resolution
+        return (
+            max(int(int(width) * scale) // 2 * 2, 2),
+            max(int(int(height) * scale) // 2 * 2, 2),
+        )
+
+    def burn_overlays(self, video, sync_file_path, width, height, start=0):
+        """Burn in subtitles and the pre-rendered overlay text and logo."""
+        if sync_file_path:
+            # Shift timestamps while rendering an excerpt so the cues line up
+            if start:
+                video = video.filter("setpts", f"PTS+{start}/TB")
+            video = video.filter("subtitles", sync_file_path)
+            if start:
+                video = video.filter("setpts", "PTS-STARTPTS")
+        # Overlays are rasterized once per resolution instead of every frame
+        for image_path, x, y in self.watermark_renderer.get_overlays(width, height):
+            video = video.overlay(ffmpeg.input(image_path).video, x=x, y=y)
+        return video
+
+    def should_package_hls(self, task_config: Config, container):
+        if not task_config.hls:
+            return False
+        if task_config.preview or container != "mp4":
+            logging.warning("HLS packaging needs a full mp4 render, skipping it")
+            return False
+        return True
+
+    def get_hls_playlist_path(self, output_file_path):
+        """Master playlist of the HLS package written next to a render."""
+        hls_dir = f"{os.path.splitext(output_file_path)[0]}_hls"
+        return os.path.join(hls_dir, "index.m3u8")
+
+    def create_hls_output(
+        self,
+        video,
+        ina,
+        output_file_path,
+        width,
+        height,
+        frame_rate,
+        task_config: Config,
+        encode_args,
+        output_args,
+    ):
+        """Encode the mp4 and its HLS renditions from a single decode.
+
+        The full size encode is written to both the mp4 and the top HLS
+        rendition through the tee muxer. Smaller ladder rungs are scaled from
+        a split of the same composited frames, so subtitles render only once.
+        """
+        playlist_path = self.get_hls_playlist_path(output_file_path)
+        hls_dir = os.path.dirname(playlist_path)
+        os.makedirs(hls_dir, exist_ok=True)
+        fmp4 = task_config.hls_segment_type == "fmp4"
+
+        renditions = [(width, height)] + [
+            self.scale_resolution((width, height), scale)
+            for scale in task_config.hls_ladder
+        ]
+        self.write_hls_master_playlist(playlist_path, renditions, frame_rate, fmp4)
+        if task_config.progress_tracker:
+            task_config.progress_tracker.publish_artifact(
+                "hls_playlist_path", playlist_path
+            )
+
+        split = video.filter_multi_output("split", len(renditions))
+        outputs = []
+        for i, (rung_width, rung_height) in enumerate(renditions):
+            name = f"{rung_width}x{rung_height}"
+            hls_options = [
+                "hls_time=4",
+                "hls_playlist_type=event",
+                f"hls_segment_type={'fmp4' if fmp4 else 'mpegts'}",
+                "hls_segment_filename="
+                + os.path.join(hls_dir, f"{name}_%03d.{'m4s' if fmp4 else 'ts'}"),
+            ]
+            if fmp4:
+                hls_options.append(f"hls_fmp4_init_filename={name}_init.mp4")
+            rendition_path = os.path.join(hls_dir, f"{name}.m3u8")
+            if i == 0:
+                mp4_options = ":".join(f"{k}={v}" for k, v in output_args.items())
+                mp4_spec = f"[{mp4_options}]" if mp4_options else ""
+                tee = (
+                    f"{mp4_spec}{output_file_path}"
+                    f"|[f=hls:{':'.join(hls_options)}]{rendition_path}"
+                )
+                # The tee muxer has no default encoder, so name it explicitly
+                outputs.append(
+                    ffmpeg.output(
+                        split[i],
+                        ina.audio,
+                        tee,
+                        format="tee",
+                        vcodec="libx264",
+                        **encode_args,
+                    )
+                )
+            else:
+                rung = split[i].filter("scale", rung_width, rung_height)
+                outputs.append(
+                    ffmpeg.output(
+                        rung,
+                        ina.audio,
+                        rendition_path,
+                        format="hls",
+                        **dict(option.split("=", 1) for option in hls_options),
+                        **encode_args,
+                    )
+                )
+        return ffmpeg.merge_outputs(*outputs).overwrite_output()
+
+    def write_hls_master_playlist(self, playlist_path, renditions, frame_rate, fmp4):
+        """Master playlist listing every rendition with a nominal bandwidth."""
+        lines = ["#EXTM3U", f"#EXT-X-VERSION:{7 if fmp4 else 3}"]
+        for width, height in renditions:
+            # Rough x264 "fast" preset estimate, 0.1 bit per pixel plus audio
+            bandwidth = int(width * height * frame_rate * 0.1) + 192_000
+            lines.append(
+                f"#EXT-X-STREAM-INF:BANDWIDTH={bandwidth},RESOLUTION={width}x{height}"
+            )
+            lines.append(f"{width}x{height}.m3u8")
+        with open(playlist_path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+
+    def create_soft_subtitles_output(
+        self,
+        video,
+        ina,
+        sync_file_path,
+        output_file_path,
+        acodec,
+        copy_video,
+        container,
+        start,
+        duration,
+        preset,
+        output_args,
+    ):
+        """Mux subtitles as a track instead of burning them into the frames.
+
+        ASS/SRT is kept as is in mkv and converted to mov_text in mp4, which
+        drops the ASS animations. The watermark is not drawn in this mode.
+        """
+        if copy_video:
+            video_args = {"vcodec": "copy"}
+        else:
+            video_args = {"preset": preset, "pix_fmt": "yuv420p"}
+        streams = [video, ina.audio]
+        if sync_file_path:
+            streams.append(
+                ffmpeg.input(sync_file_path, itsoffset=-start)
+                if start
+                else ffmpeg.input(sync_file_path)
+            )
+            video_args["scodec"] = "mov_text" if container == "mp4" else "copy"
+        return ffmpeg.output(
+            *streams,
+            output_file_path,
+            acodec=acodec,
+            shortest=None,
+            t=duration,
+            **video_args,
+            **output_args,
+        ).overwrite_output()
+
+    def get_container_args(self, mp4_mode, container):
+        """Extra muxer options for faststart or fragmented MP4 output."""
+        movflags = self.MP4_MOVFLAGS.get(mp4_mode)
+        if container != "mp4" or not movflags:
+            return {}
+        return {"movflags": movflags}
+
+    def prepare_audio(self, audio_path, container):
+        """Return the audio source and codec to use for the output container.
+
+        Compatible audio streams are copied. Anything else is encoded to AAC
+        once per source content and reused by later renders of the same song.
+        """
+        try:
+            probe = ffmpeg.probe(audio_path)
+            audio_stream = next(
+                (s for s in probe["streams"] if s["codec_type"] == "audio"), None
+            )
+        except ffmpeg.Error as e:
+            logging.warning(f"Could not probe audio: {e.stderr.decode()}")
+            audio_stream = None
+        codec = audio_stream.get("codec_name") if audio_stream else None
+        if codec and (container == "mkv" or codec in self.MP4_AUDIO_CODECS):
+            logging.info(f"Copying {codec} audio stream from {audio_path}")
+            return audio_path, "copy"
+
+        os.makedirs(self.audio_cache_path, exist_ok=True)
+        aac_path = os.path.join(
+            self.audio_cache_path, f"{hash_file(audio_path)[:32]}_aac.m4a"
+        )
+        with self.audio_cache_lock:
+            record_cache("audio", os.path.exists(aac_path))
+            if not os.path.exists(aac_path):
+                partial_path = f"{aac_path}.{os.getpid()}.partial.m4a"
+                ffmpeg.input(audio_path).output(
+                    partial_path, vn=None, acodec="aac", audio_bitrate="192k"
+                ).overwrite_output().run(capture_stdout=True, capture_stderr=True)
+                os.replace(partial_path, aac_path)
+                logging.info(f"Audio encoded to AAC: {aac_path}")
+            else:
+                logging.info(f"Reusing cached AAC audio {aac_path}")
+        return aac_path, "copy"
+
+    def can_copy_video(self, video_path, width, height):
+        """Whether a background video can be stream-copied at this resolution."""
+        if self.is_image(video_path):
+            return False
+        try:
+            probe = ffmpeg.probe(video_path)
+        except ffmpeg.Error as e:
+            logging.warning(f"Could not probe background: {e.stderr.decode()}")
+            return False
+        video_stream = next(
+            (s for s in probe["streams"] if s["codec_type"] == "video"), None
+        )
+        return bool(
+            video_stream
+            and int(video_stream.get("width", 0)) == int(width)
+            and int(video_stream.get("height", 0)) == int(height)
+            and video_stream.get("codec_name") in self.COPYABLE_VIDEO_CODECS
+        )
+
+    def is_image(self, path):
+        return path.lower().endswith(self.IMAGE_EXTENSIONS)
+
+    def normalize_background(
+        self, background_path, width, height, frame_rate, create=True
+    ):
+        """Transcode a background once into a cached mezzanine for a resolution.
+
+        Images become a single pre-padded PNG, videos an audio-less H.264 file at
+        the target size and frame rate with a one second GOP, so renders only
+        decode it. Returns None if the mezzanine is missing and not created.
+        """
+        os.makedirs(self.background_cache_path, exist_ok=True)
+        key = f"{hash_file(background_path)[:32]}_{width}x{height}"
+        if self.is_image(background_path):
+            normalized_path = os.path.join(self.background_cache_path, f"{key}.png")
+        else:
+            fps = round(frame_rate, 3)
+            normalized_path = os.path.join(
+                self.background_cache_path, f"{key}_{fps}fps.mp4"
+            )
+        record_cache("background", os.path.exists(normalized_path))
+        if os.path.exists(normalized_path):
+            logging.info(f"Reusing normalized background {normalized_path}")
+            return normalized_path
+        if not create:
+            return None
+
+        base, ext = os.path.splitext(normalized_path)
+        partial_path = f"{base}.{os.getpid()}.{threading.get_ident()}.partial{ext}"
+        video = self.scale_and_pad(ffmpeg.input(background_path).video, width, height)
+        try:
+            if self.is_image(background_path):
+                out = ffmpeg.output(video, partial_path, vframes=1)
+            else:
+                out = ffmpeg.output(
+                    video.filter("fps", fps=fps),
+                    partial_path,
+                    an=None,
+                    vcodec="libx264",
+                    preset="veryfast",
+                    crf=18,
+                    g=max(int(round(fps)), 1),
+                    pix_fmt="yuv420p",
+                )
+            out.overwrite_output().run(capture_stdout=True, capture_stderr=True)
+            # Publish atomically so concurrent renders never see a partial file
+            os.replace(partial_path, normalized_path)
+            logging.info(f"Background normalized: {normalized_path}")
+            return normalized_path
+        except ffmpeg.Error as e:
+            logging.error(f"Error normalizing background: {e.stderr.decode()}")
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+            return None
+
+    def prepare_background(
+        self, background_path, frame_rate, duration, start=0, has_audio=True
+    ):
+        """Prepare background video or image for video creation."""
+        if self.is_image(background_path):
             return ffmpeg.input(
                 background_path, loop=1, t=duration, framerate=frame_rate
             )
         else:
-            stripped_video_path = background_path + "_background_no_audio.mp4"
-            background_path = self.strip_audio_from_video(
-                background_path, stripped_video_path
-            )
+            if has_audio:
+                stripped_video_path = background_path + "_background_no_audio.mp4"
+                background_path = self.strip_audio_from_video(
+                    background_path, stripped_video_path
+                )
+            if start:
+                return ffmpeg.input(background_path, stream_loop=-1, ss=start)
             return ffmpeg.input(background_path, stream_loop=-1)
 
-    def create_video_filters(self, width, height, sync_file_path):
-        """Create scaling and padding filters for video."""
-        scale_filter = (
-            f"scale='if(gt(iw/ih,{width}/{height}),{width},-2)':"
-            f"'if(gt(iw/ih,{width}/{height}),-2,{height})'"
-        )
-        pad_filter = f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2:color=black"
-        vf_filters = f"{scale_filter},{pad_filter}"
-        return vf_filters
+    def scale_and_pad(self, video, width, height):
+        """Scale & pad video to fit inside the given resolution."""
+        wider = f"gt(iw/ih,{width}/{height})"
+        return video.filter(
+            "scale", f"if({wider},{width},-2)", f"if({wider},-2,{height})"
+        ).filter("pad", width, height, "(ow-iw)/2", "(oh-ih)/2", color="black")
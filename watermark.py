@@ -0,0 +1,74 @@
+import hashlib
+import os
+from PIL import Image, ImageDraw, ImageFont
+from hashing import hash_file
+
+
+class WatermarkRenderer:
+    """Renders the overlay text and logo once per resolution into RGBA images."""
+
+    MARGIN = 5
+
+    def __init__(self, config):
+        self.config = config
+        self.cache_path = os.path.join(self.config.input_cache, "overlay_cache")
+
+    def get_overlays(self, width, height):
+        """Return (image path, x, y) of every overlay for a video resolution."""
+        overlays = []
+        if self.config.overlay_text:
+            text_path = self.render_text(self.config.overlay_text, width, height)
+            overlays.append((text_path, self.MARGIN, self.MARGIN))
+        if self.config.overlay_logo:
+            logo_path = self.render_logo(self.config.overlay_logo, width, height)
+            overlays.append((logo_path, f"W-w-{self.MARGIN}", self.MARGIN))
+        return overlays
+
+    def render_text(self, text, width, height):
+        # Same size the drawtext filter used: sqrt(w*h)*0.05
+        font_size = max(int((width * height) ** 0.5 * 0.05), 1)
+        key = hashlib.sha256(
+            f"{text}|{self.config.overlay_font}|{font_size}".encode()
+        ).hexdigest()[:32]
+        image_path = os.path.join(self.cache_path, f"text_{key}.png")
+        if os.path.exists(image_path):
+            return image_path
+
+        font = self.load_font(font_size)
+        left, top, right, bottom = ImageDraw.Draw(Image.new("RGBA", (1, 1))).textbbox(
+            (0, 0), text, font=font
+        )
+        image = Image.new("RGBA", (max(right, 1), max(bottom, 1)), (0, 0, 0, 0))
+        ImageDraw.Draw(image).text((0, 0), text, font=font, fill=(255, 255, 255, 255))
+        return self.save(image, image_path)
+
+    def render_logo(self, logo_path, width, height):
+        logo_height = max(int(min(width, height) * 0.1), 1)
+        key = f"{hash_file(logo_path)[:32]}_{logo_height}"
+        image_path = os.path.join(self.cache_path, f"logo_{key}.png")
+        if os.path.exists(image_path):
+            return image_path
+
+        with Image.open(logo_path) as logo:
+            logo = logo.convert("RGBA")
+            logo_width = max(int(logo.width * logo_height / logo.height), 1)
+            image = logo.resize((logo_width, logo_height), Image.LANCZOS)
+        return self.save(image, image_path)
+
+    def load_font(self, font_size):
+        try:
+            return ImageFont.truetype(self.config.overlay_font, font_size)
+        except OSError:
+            try:
+                return ImageFont.load_default(size=font_size)
+            except TypeError:
+                # Pillow < 10.1 only ships a fixed size bitmap font
+                return ImageFont.load_default()
+
+    def save(self, image, image_path):
+        os.makedirs(self.cache_path, exist_ok=True)
+        partial_path = f"{image_path}.{os.getpid()}.partial.png"
+        image.save(partial_path, "PNG")
+        # Publish atomically so concurrent renders never read a partial image
+        os.replace(partial_path, image_path)
+        return image_path
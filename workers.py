@@ -0,0 +1,328 @@
+import gc
+import itertools
+import logging
+import multiprocessing
+import multiprocessing.connection
+import os
+import threading
+import time
+from concurrent.futures import Future
+from config import Config
+from hashing import stamp_file
+from metrics import REGISTRY
+from pipeline import StageScheduler
+from progress import ProgressTracker
+
+
+# Seconds between metric updates a busy worker sends to the server process
+METRICS_INTERVAL = 5
+# Seconds before a dead worker is replaced
+RESTART_DELAY = 1
+
+
+class QueueFull(Exception):
+    """The job queue holds its maximum number of waiting jobs."""
+
+
+def process_memory(pid):
+    """RSS, PSS and private memory of a process in bytes, from smaps_rollup.
+
+    Pages a forked worker still shares with its parent count in its RSS but
+    not in its private memory, which is what each extra worker costs.
+    """
+    fields = {"Rss": "rss", "Pss": "pss", "Private_Clean": "private"}
+    fields["Private_Dirty"] = "private"
+    memory = {"rss": 0, "pss": 0, "private": 0}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            if key in fields:
+                memory[fields[key]] += int(value.split()[0]) * 1024
+    return memory
+
+
+def worker_loop(generator, tasks, results, tasks_per_worker=1):
+    """Run tasks from the queue, up to tasks_per_worker at once.
+
+    Concurrent tasks of a worker share its stage pools, so their stages
+    overlap like they do in a single process server.
+    """
+    scheduler = StageScheduler(generator.config.stage_workers)
+    slots = threading.Semaphore(tasks_per_worker)
+
+    def send_metrics():
+        changes = REGISTRY.collect_changes()
+        if changes:
+            results.put(("metrics", None, (os.getpid(), changes)))
+
+    def send_metrics_forever():
+        while True:
+            time.sleep(METRICS_INTERVAL)
+            send_metrics()
+
+    send_metrics()
+    threading.Thread(target=send_metrics_forever, daemon=True).start()
+    results.put(("ready", None, os.getpid()))
+    while True:
+        slots.acquire()
+        item = tasks.get()
+        if item is None:
+            # Let the running tasks finish before leaving
+            for _ in range(tasks_per_worker - 1):
+                slots.acquire()
+            scheduler.shutdown()
+            return
+        job_id, user_data = item
+        results.put(("started", job_id, os.getpid()))
+
+        def report(future, job_id=job_id):
+            # Stage timings and the job outcome are in /metrics once it ends
+            send_metrics()
+            try:
+                result = future.result()
+                if result:
+                    # Hashed here, the server's ETags need not read the files
+                    result["artifact_hashes"] = artifact_hashes(result)
+                results.put(("result", job_id, result))
+            except Exception as e:
+                logging.error(f"Worker {os.getpid()} failed on job {job_id}: {e}")
+                results.put(("error", job_id, str(e)))
+            slots.release()
+
+        task_config = Config(
+            generator.config.input_cache,
+            generator.config.output_cache,
+            generator.config.vocal_separator_model,
+        )
+        task_config.from_user_data(user_data)
+        task_config.progress_tracker = ProgressTracker(
+            callback=lambda snapshot, job_id=job_id: results.put(
+                ("progress", job_id, snapshot)
+            )
+        )
+        try:
+            future = generator.submit(task_config, scheduler)
+        except Exception as e:
+            future = Future()
+            future.set_exception(e)
+        future.add_done_callback(report)
+
+
+def artifact_hashes(result):
+    """Stamps of the files of a task result, by path."""
+    paths = []
+    for value in result.values():
+        if isinstance(value, dict):
+            paths.extend(value.values())
+        else:
+            paths.append(value)
+    return {
+        path: stamp_file(path)
+        for path in paths
+        if isinstance(path, str) and os.path.isfile(path)
+    }
+
+
+def fork_worker_loop(generator, tasks, results, tasks_per_worker=1):
+    """Run tasks with the models the parent loaded before forking."""
+    # The copied registry holds the parent's metrics, only send what follows
+    REGISTRY.collect_changes()
+    worker_loop(generator, tasks, results, tasks_per_worker)
+
+
+def spawn_worker_loop(config, tasks, results, tasks_per_worker=1):
+    """Load the models in this process, then run tasks."""
+    from lyri_core import LyricsVideoGenerator
+
+    worker_loop(LyricsVideoGenerator(config), tasks, results, tasks_per_worker)
+
+
+class WorkerPool:
+    """Worker processes that run whole tasks, fed from a bounded queue.
+
+    With models on the CPU, workers are forked from a parent that already
+    loaded them and share the weights copy-on-write. CUDA contexts do not
+    survive fork, so with gpu_on every worker is spawned and loads its own
+    models instead. A worker that dies fails the jobs it was running and is
+    replaced by a spawned one: by then the parent runs threads, and a fork
+    could copy a lock one of them holds.
+    """
+
+    def __init__(self, config, workers, max_queue=None, tasks_per_worker=1):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.tasks_per_worker = tasks_per_worker
+        self.config = config
+        self.preloaded = not config.gpu_on
+        self.jobs = {}
+        self.waiting = []
+        self.started_at = {}
+        self.running = {}  # Job id -> pid of the worker running it
+        self.dead_workers = set()
+        self.closing = False
+        self.average_duration = None
+        self.job_ids = itertools.count()
+        self.lock = threading.Lock()
+        self.ready_times = {}
+
+        # Spawn context queues, so forked and spawned workers can share them
+        spawn_context = multiprocessing.get_context("spawn")
+        self.tasks = spawn_context.Queue()
+        self.results = spawn_context.Queue()
+        self.started = time.perf_counter()
+        if self.preloaded:
+            # Only a parent that forks its workers loads the models itself
+            from lyri_core import LyricsVideoGenerator
+
+            generator = LyricsVideoGenerator(config)
+            generator.model_manager.preload()
+            # Keep the collector from touching, and so copying, the shared objects
+            gc.freeze()
+            # Forked before any of the pool's threads start
+            self.processes = [
+                self.start_worker(
+                    multiprocessing.get_context("fork"), fork_worker_loop, generator
+                )
+                for _ in range(workers)
+            ]
+        else:
+            self.processes = [self.start_worker() for _ in range(workers)]
+        threading.Thread(target=self.read_results, daemon=True).start()
+        threading.Thread(target=self.watch_workers, daemon=True).start()
+        mode = "forked after loading" if self.preloaded else "spawned, each loading"
+        logging.info(f"Started {workers} workers, {mode} the models")
+
+    def start_worker(self, context=None, target=spawn_worker_loop, generator=None):
+        """Start a worker, spawned with the config unless given a fork context."""
+        context = context or multiprocessing.get_context("spawn")
+        process = context.Process(
+            target=target,
+            args=(
+                generator or self.config,
+                self.tasks,
+                self.results,
+                self.tasks_per_worker,
+            ),
+            daemon=True,
+        )
+        process.start()
+        return process
+
+    def watch_workers(self):
+        """Fail the jobs of workers that exit unexpectedly and replace them."""
+        while not self.closing:
+            sentinels = {process.sentinel: process for process in self.processes}
+            for sentinel in multiprocessing.connection.wait(list(sentinels), 1):
+                process = sentinels[sentinel]
+                process.join()
+                if self.closing:
+                    return
+                logging.error(
+                    f"Worker {process.pid} exited with code {process.exitcode}, "
+                    "spawning a new one"
+                )
+                REGISTRY.forget(process.pid)
+                with self.lock:
+                    self.dead_workers.add(process.pid)
+                    lost_jobs = [
+                        job_id
+                        for job_id, pid in self.running.items()
+                        if pid == process.pid
+                    ]
+                for job_id in lost_jobs:
+                    self.fail_job(job_id, f"Worker {process.pid} died")
+                # A worker that cannot start must not be restarted in a busy loop
+                time.sleep(RESTART_DELAY)
+                self.processes[self.processes.index(process)] = self.start_worker()
+
+    def fail_job(self, job_id, error):
+        with self.lock:
+            if job_id not in self.jobs:
+                return
+            future, _ = self.jobs.pop(job_id)
+            self.running.pop(job_id, None)
+            self.started_at.pop(job_id, None)
+        future.set_exception(RuntimeError(error))
+
+    def submit(self, user_data, progress_callback=None, job_id=None, bounded=True):
+        """Queue a task; the future resolves to the generate() result.
+
+        Raises QueueFull when bounded and max_queue jobs are already waiting.
+        """
+        future = Future()
+        with self.lock:
+            if bounded and self.is_full():
+                raise QueueFull()
+            if job_id is None or job_id in self.jobs:
+                job_id = f"job-{next(self.job_ids)}"
+            self.jobs[job_id] = (future, progress_callback)
+            self.waiting.append(job_id)
+        self.tasks.put((job_id, user_data))
+        return future
+
+    def is_full(self):
+        return self.max_queue is not None and len(self.waiting) >= self.max_queue
+
+    def position(self, job_id):
+        """1-based place of a waiting job, 0 once running, None if unknown."""
+        with self.lock:
+            if job_id in self.waiting:
+                return self.waiting.index(job_id) + 1
+            return 0 if job_id in self.jobs else None
+
+    def retry_after(self):
+        """Seconds until a running task likely ends and frees a queue slot."""
+        duration = self.average_duration or 60
+        return max(int(duration / (self.workers * self.tasks_per_worker)), 1)
+
+    def read_results(self):
+        while True:
+            kind, job_id, payload = self.results.get()
+            if kind == "ready":
+                self.ready_times[payload] = time.perf_counter() - self.started
+                continue
+            if kind == "metrics":
+                pid, changes = payload
+                REGISTRY.merge(changes, source=pid)
+                continue
+            with self.lock:
+                if job_id not in self.jobs:
+                    # Already failed, its worker died
+                    continue
+                future, progress_callback = self.jobs[job_id]
+                if kind == "started":
+                    self.waiting.remove(job_id)
+                    self.started_at[job_id] = time.monotonic()
+                    self.running[job_id] = payload
+                elif kind != "progress":
+                    del self.jobs[job_id]
+                    self.running.pop(job_id, None)
+                    self.record_duration(job_id)
+            if kind == "started" and payload in self.dead_workers:
+                # The worker died before its start was read
+                self.fail_job(job_id, f"Worker {payload} died")
+                continue
+            if kind == "progress":
+                if progress_callback:
+                    progress_callback(payload)
+            elif kind == "result":
+                future.set_result(payload)
+            elif kind == "error":
+                future.set_exception(RuntimeError(payload))
+
+    def record_duration(self, job_id):
+        started_at = self.started_at.pop(job_id, None)
+        if started_at is None:
+            return
+        duration = time.monotonic() - started_at
+        if self.average_duration is None:
+            self.average_duration = duration
+        else:
+            self.average_duration = 0.8 * self.average_duration + 0.2 * duration
+
+    def shutdown(self):
+        self.closing = True
+        for _ in self.processes:
+            self.tasks.put(None)
+        for process in self.processes:
+            process.join()